@@ -0,0 +1,187 @@
+"""
+Microbenchmark and differential check of the shared movies parsing module.
+Compares fast path parsing of titles and genres with the regexp-only path
+on movies.csv and edge cases: outputs should be identical, for per-value
+and column (batch) functions alike.
+Usage: python parsing_bench.py [<movies.csv>]
+"""
+
+import csv
+import os
+import re
+import sys
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+sys.path.insert(0, os.path.join(BASE_DIR, '..', 'common'))
+
+import parsing  # noqa: E402
+
+# Default movies file of the pure python engine
+MOVIES_PATH = os.path.join(BASE_DIR, '..', 'task02-get-movies', 'data', 'movies.csv')
+
+# Default no genres regexp of the engines configs
+NO_GENRES_REGEXP = r'\(no genres listed\)'
+
+# Titles and genres the fast path should reject or pass to the regexp
+EDGE_TITLES = ['Movie (1999)', ' Movie (1999) ', 'Movie', '(1999)', ' (1999)', 'A (1999)',
+               'Movie (1999) (2000)', 'Movie (1999))', 'Movie (199)', 'Movie (19a9)',
+               'Movie (１９９９)', 'Movie (١٩٩٩)', 'Movie(1999)', 'Movie  (1999)',
+               'Line\nbreak (1999)', 'Movie (1999) extra', 'Movie (1999)\n', '']
+EDGE_GENRES = ['(no genres listed)', ' (no genres listed) ', 'Drama', 'Drama|War', '',
+               'Drama|(no genres listed)', '(no genres listed)|Drama', '(No genres listed)']
+
+
+def regexp_patterns(title_regexp, no_genres_regexp):
+    """
+    Return patterns with fast paths disabled: the regexp-only path.
+    """
+    patterns = parsing.compile_patterns(title_regexp, no_genres_regexp)
+    patterns['fast_title'] = False
+    patterns['no_genres'] = None
+
+    return patterns
+
+
+def load_columns(filepath):
+    """
+    Return raw titles and raw genres columns of the movies csv-file.
+    """
+    with open(filepath, encoding='utf-8') as movies_file:
+        rows = list(csv.DictReader(movies_file))
+
+    return [row['title'] for row in rows], [row['genres'] for row in rows]
+
+
+def split_each(split, values, patterns):
+    """
+    Split `values` one by one with the per-value `split` function.
+    Return list of results, None for invalid values.
+    """
+    result = []
+
+    for value in values:
+        try:
+            result.append(split(value, patterns))
+        except Exception:
+            result.append(None)
+
+    return result
+
+
+def compare(kind, name, values, results, expected):
+    """
+    Print results differing from the expected ones.
+    Return mismatches count.
+    """
+    mismatches = 0
+
+    for value, result, expected_result in zip(values, results, expected):
+        if result != expected_result:
+            mismatches += 1
+            print(f"{kind} mismatch of {name}: {value!r}: {result} != {expected_result}")
+
+    return mismatches
+
+
+def check(titles, genres):
+    """
+    Compare per-value and batch functions, with and without fast paths,
+    with the per-value regexp-only path for each known title regexp.
+    Return mismatches count.
+    """
+    mismatches = 0
+
+    for title_regexp in parsing.FAST_TITLE_REGEXPS:
+        fast = parsing.compile_patterns(title_regexp, NO_GENRES_REGEXP)
+        slow = regexp_patterns(title_regexp, NO_GENRES_REGEXP)
+
+        expected_titles = split_each(parsing.split_title, titles, slow)
+        expected_genres = split_each(parsing.split_genres, genres, slow)
+
+        cases = [('fast path', fast), ('regexp-only', slow)]
+        for name, patterns in cases:
+            mismatches += compare('Title', f"{name} {title_regexp!r}", titles,
+                                  split_each(parsing.split_title, titles, patterns), expected_titles)
+            mismatches += compare('Title', f"{name} batch {title_regexp!r}", titles,
+                                  parsing.split_titles(titles, patterns), expected_titles)
+            mismatches += compare('Genres', name, genres,
+                                  split_each(parsing.split_genres, genres, patterns), expected_genres)
+            mismatches += compare('Genres', f"{name} batch", genres,
+                                  parsing.split_genres_column(genres, patterns), expected_genres)
+
+    return mismatches
+
+
+def legacy_parse(titles, genres, title_regexp, no_genres_regexp):
+    """
+    Parse columns the way engines did before: regexp search on each value.
+    """
+    for raw_title, raw_genres in zip(titles, genres):
+        try:
+            re_title, re_year = re.search(title_regexp, raw_title.strip()).groups()
+            int(re_year)
+            if not re.search(no_genres_regexp, raw_genres.strip()):
+                raw_genres.strip().split('|')
+        except Exception:
+            continue
+
+
+def single_parse(titles, genres, patterns):
+    """
+    Parse columns value by value with the shared module.
+    """
+    for raw_title, raw_genres in zip(titles, genres):
+        try:
+            parsing.split_title(raw_title, patterns)
+            parsing.split_genres(raw_genres, patterns)
+        except Exception:
+            continue
+
+
+def batch_parse(titles, genres, patterns):
+    """
+    Parse whole columns with the batch API.
+    """
+    parsing.split_titles(titles, patterns)
+    parsing.split_genres_column(genres, patterns)
+
+
+def bench(titles, genres, repeat=5):
+    """
+    Print best time of each parsing path over the columns.
+    """
+    title_regexp = parsing.FAST_TITLE_REGEXPS[0]
+    fast = parsing.compile_patterns(title_regexp, NO_GENRES_REGEXP)
+    slow = regexp_patterns(title_regexp, NO_GENRES_REGEXP)
+
+    cases = [('legacy re.search', lambda: legacy_parse(titles, genres, title_regexp, NO_GENRES_REGEXP)),
+             ('regexp-only', lambda: single_parse(titles, genres, slow)),
+             ('fast path', lambda: single_parse(titles, genres, fast)),
+             ('fast path batch', lambda: batch_parse(titles, genres, fast))]
+
+    print(f"Rows: {len(titles)}")
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=1, repeat=repeat))
+        print(f"{name:<18}{seconds * 1000:>10.2f} ms")
+
+
+def main():
+    """
+    Entry point: check paths equality, then benchmark them.
+    """
+    filepath = sys.argv[1] if len(sys.argv) > 1 else MOVIES_PATH
+    titles, genres = load_columns(filepath)
+
+    mismatches = check(titles + EDGE_TITLES, genres + EDGE_GENRES)
+    print(f"Mismatches: {mismatches}")
+
+    if mismatches:
+        sys.exit(1)
+
+    bench(titles, genres)
+
+
+if __name__ == '__main__':
+    main()
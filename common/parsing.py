@@ -0,0 +1,134 @@
+"""
+Movies title and genres parsing shared by get-movies engines.
+Fast path splits the trailing `(YYYY)` of titles by slicing and compares
+genres with the no genres placeholder literally, configured regexps
+are searched only when the fast path fails.
+Single source for all the engines: pure python and auto engines and the local
+MapReduce executor import it from here, docker_prepare.sh copies it for Hadoop
+jobs, so it stays Python 2 compatible.
+"""
+
+import re
+
+# Title regexps the fast path is equivalent to: title and year of a title
+# ending with ` (YYYY)` are split by slicing, other titles go to the regexp
+FAST_TITLE_REGEXPS = (r'(.+) \((\d{4})\)',
+                      r'^(?P<title>.*) \((?P<year>[0-9]{4})\)+$')
+
+# No genres regexps the fast path is equivalent to: literal placeholder
+FAST_NO_GENRES = {r'\(no genres listed\)': '(no genres listed)'}
+
+# ASCII digits of the year, as `\d` and `[0-9]` match them
+DIGITS = frozenset('0123456789')
+
+
+def compile_patterns(title_regexp, no_genres_regexp):
+    """
+    Compile configured regexps, fast paths are enabled for the known ones only.
+    Return patterns: { title_regexp, no_genres_regexp, fast_title, no_genres }
+    """
+    return {'title_regexp': re.compile(title_regexp),
+            'no_genres_regexp': re.compile(no_genres_regexp),
+            'fast_title': title_regexp in FAST_TITLE_REGEXPS,
+            'no_genres': FAST_NO_GENRES.get(no_genres_regexp)}
+
+
+def split_title(raw_title, patterns):
+    """
+    Split `raw_title` string into the real title and year.
+    Return them as a tuple of (title, year).
+    """
+    raw_title = raw_title.strip()
+
+    # Fast path: `<title> (YYYY)`, title of a single line
+    if patterns['fast_title'] and len(raw_title) > 7 and raw_title[-1] == ')' \
+            and raw_title[-6] == '(' and raw_title[-7] == ' ':
+        raw_year = raw_title[-5:-1]
+        if raw_year[0] in DIGITS and raw_year[1] in DIGITS and raw_year[2] in DIGITS \
+                and raw_year[3] in DIGITS and '\n' not in raw_title:
+            return raw_title[:-7], int(raw_year)
+
+    return search_title(raw_title, patterns)
+
+
+def search_title(raw_title, patterns):
+    """
+    Split stripped `raw_title` string by the title regexp.
+    Return tuple of (title, year).
+    """
+    re_result = patterns['title_regexp'].search(raw_title)
+    if not re_result:
+        raise Exception("invalid title")
+
+    re_title, re_year = re_result.groups()
+
+    return re_title, int(re_year)
+
+
+def split_genres(raw_genres, patterns):
+    """
+    Split `raw_genres` string into the genres list.
+    Return genres list.
+    """
+    raw_genres = raw_genres.strip()
+
+    # Fast path: placeholder is compared literally, it can't match without '('
+    no_genres = patterns['no_genres']
+    if no_genres is not None:
+        if raw_genres == no_genres:
+            raise Exception("invalid genre")
+        if '(' not in raw_genres:
+            return raw_genres.split('|')
+
+    if patterns['no_genres_regexp'].search(raw_genres):
+        raise Exception("invalid genre")
+
+    return raw_genres.split('|')
+
+
+def split_titles(raw_titles, patterns):
+    """
+    Split a column of raw titles at once: the fast path runs inline
+    over the whole column, only the titles it misses are searched.
+    Return list of (title, year) tuples, None for invalid titles.
+    """
+    titles = [raw_title.strip() for raw_title in raw_titles]
+
+    if patterns['fast_title']:
+        result = [(title[:-7], int(title[-5:-1]))
+                  if len(title) > 7 and title[-1] == ')' and title[-6] == '(' and title[-7] == ' '
+                  and DIGITS.issuperset(title[-5:-1]) and '\n' not in title else None
+                  for title in titles]
+    else:
+        result = [None] * len(titles)
+
+    for i, title in enumerate(titles):
+        if result[i] is None:
+            try:
+                result[i] = search_title(title, patterns)
+            except Exception:
+                continue
+
+    return result
+
+
+def split_genres_column(raw_genres_column, patterns):
+    """
+    Split a column of raw genres at once: genres without '(' are split
+    inline when the placeholder is literal, the others are searched.
+    Return list of genres lists, None for movies without genres.
+    """
+    column = [raw_genres.strip() for raw_genres in raw_genres_column]
+
+    if patterns['no_genres'] is not None:
+        result = [None if '(' in raw_genres else raw_genres.split('|') for raw_genres in column]
+    else:
+        result = [None] * len(column)
+
+    no_genres_regexp = patterns['no_genres_regexp']
+
+    for i, raw_genres in enumerate(column):
+        if result[i] is None and not no_genres_regexp.search(raw_genres):
+            result[i] = raw_genres.split('|')
+
+    return result
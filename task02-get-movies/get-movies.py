@@ -6,14 +6,39 @@ Source filepaths specified in config file.
 
 import argparse
 import configparser
+import cProfile
 import csv
+import hashlib
+import io
+import json
+import os
 import re
+import struct
 import sys
+import time
+import tracemalloc
+from array import array
 from collections import deque
+from contextlib import contextmanager
+
+# Parsing module shared by the engines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import parsing  # noqa: E402
 
 # Global config
 config = {}
 
+# Phases profile: { phase: { wall, cpu, peak_memory, rows } }
+profile = {}
+
+# Ratings checkpoint header: magic, consumed offset, prefix sha256, movies count
+CHECKPOINT_MAGIC = b'GMRCKPT1'
+CHECKPOINT_HEADER = struct.Struct('<8sQ32sQ')
+
+# Ratings file read chunk size
+CHUNK_SIZE = 1 << 22
+
 
 def configure():
     """
@@ -36,6 +61,11 @@ def configure():
 
         config['title_regexp'] = parser.get('Extraction', 'title_regexp')
         config['no_genres_regexp'] = parser.get('Extraction', 'no_genres_regexp')
+
+        config['patterns'] = parsing.compile_patterns(config['title_regexp'], config['no_genres_regexp'])
+
+        config['checkpoint_fpath'] = parser.get('Cache', 'checkpoint_path')
+        config['verify_size'] = int(parser.get('Cache', 'verify_size'))
     except Exception:
         raise Exception("corrupted config file")
 
@@ -51,33 +81,82 @@ def create_parser():
     parser.add_argument("--year_from", metavar="<year>", help="year-from  filter")
     parser.add_argument("--year_to", metavar="<year>", help="year-to  filter")
     parser.add_argument("--regexp", metavar="<regexp>", help="regexp filter for title")
+    parser.add_argument("--profile", metavar="<file>", nargs='?', const='-',
+                        help="write phases profile as json to the file or to stderr")
+    parser.add_argument("--profile_dump", metavar="<file>", help="write cProfile stats dump to the file")
     parser.add_argument("--help", action="store_true", help="show this help message and exit")
 
     return parser
 
 
-def calc_avg_rating():
+@contextmanager
+def timed(phase):
     """
-    Calculate average rating from ratings csv-file.
-    Return average rating storage: { movieId: avg_rating }
+    Store wall time, CPU time and traced memory peak of the block
+    into the `phase` profile. Block sets `rows` of the yielded stats.
+    """
+    stats = {}
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield stats
+    finally:
+        stats['wall'] = time.perf_counter() - start_wall
+        stats['cpu'] = time.process_time() - start_cpu
+        if tracing:
+            stats['peak_memory'] = tracemalloc.get_traced_memory()[1]
+
+        profile[phase] = stats
+
+
+def ratings_columns(header):
+    """
+    Return indices of movieId and rating columns of the ratings csv header line.
+    """
+    reader = csv.reader([header.decode(config['src_encoding'])], delimiter=config['src_delimiter'])
+    fields = next(reader, [])
+
+    try:
+        return fields.index('movieId'), fields.index('rating')
+    except ValueError:
+        raise KeyError("failed to extract data")
+
+
+def parse_ratings(ratings_file, start, end, columns, rating_storage):
+    """
+    Add ratings of the ratings file lines between `start` and `end`
+    offsets into `rating_storage`, reading them by chunks.
     """
-    filepath = config['ratings_fpath']
     encoding = config['src_encoding']
     delimiter = config['src_delimiter']
+    movie_index, rating_index = columns
 
-    with open(filepath, encoding=encoding) as ratings_file:
-        reader = csv.DictReader(ratings_file, delimiter=delimiter)
+    ratings_file.seek(start)
+    position = start
 
-        # Raw ratings storage: { movieId: { total, count } }
-        rating_storage = {}
+    while position < end:
+        chunk = b''.join(ratings_file.readlines(CHUNK_SIZE))
+        if not chunk:
+            break
+
+        chunk = chunk[:end - position]
+        position += len(chunk)
+
+        reader = csv.reader(io.StringIO(chunk.decode(encoding), newline=''), delimiter=delimiter)
 
         for row in reader:
-            try:
-                # Extract rating values
-                movieId = int(row['movieId'])
-                rating = float(row['rating'])
-            except KeyError:
-                raise KeyError("failed to extract data")
+            # Skip blank lines as DictReader does
+            if not row:
+                continue
+
+            # Extract rating values
+            movieId = int(row[movie_index])
+            rating = float(row[rating_index])
 
             # Store current row rating
             if movieId in rating_storage:
@@ -88,53 +167,187 @@ def calc_avg_rating():
                 rating_storage[movieId]['total'] = rating
                 rating_storage[movieId]['count'] = 1
 
-        # Calc & store average ratings
-        for movieId, items in rating_storage.items():
-            avg_rating = items['total'] / items['count']
-            rating_storage[movieId] = avg_rating
 
-        return rating_storage
+def last_line_end(ratings_file, start, end):
+    """
+    Return offset right after the last newline between `start` and `end`,
+    or `start` if there is none.
+    """
+    position = end
 
+    while position > start:
+        block_start = max(start, position - CHUNK_SIZE)
+        ratings_file.seek(block_start)
+        block = ratings_file.read(position - block_start)
 
-def split_title(raw_title):
+        index = block.rfind(b'\n')
+        if index >= 0:
+            return block_start + index + 1
+
+        position = block_start
+
+    return start
+
+
+def prefix_fingerprint(ratings_file, offset):
     """
-    Split `raw_title` string into the real title and year.
-    Return them as a tuple of (title, year).
+    Return sha256 digest of the ratings file prefix consumed up to `offset`
+    and of the read settings. With `verify_size` only the head and the tail
+    of the prefix are hashed, so the check costs the same for any history.
     """
-    title_regexp = config['title_regexp']
+    digest = hashlib.sha256()
+    digest.update(f"{config['src_encoding']}\n{config['src_delimiter']}\n{offset}\n".encode('utf-8'))
+
+    verify_size = config['verify_size']
+    if verify_size and offset > 2 * verify_size:
+        ranges = [(0, verify_size), (offset - verify_size, offset)]
+    else:
+        ranges = [(0, offset)]
 
-    raw_title = raw_title.strip()
-    re_result = re.search(title_regexp, raw_title)
+    for start, end in ranges:
+        ratings_file.seek(start)
+        remaining = end - start
 
-    re_title, re_year = re_result.groups()
-    title, year = re_title, int(re_year)
+        while remaining > 0:
+            chunk = ratings_file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
 
-    return title, year
+            digest.update(chunk)
+            remaining -= len(chunk)
 
+    return digest.digest()
 
-def split_genres(raw_genres):
+
+def read_checkpoint(filepath):
     """
-    Split `raw_genres` string into the genres list.
-    Return genres list.
+    Read ratings checkpoint file.
+    Return (offset, fingerprint, rating_storage), or None if the checkpoint
+    is missing or corrupted.
     """
-    no_genres_regexp = config['no_genres_regexp']
+    try:
+        with open(filepath, 'rb') as f:
+            magic, offset, fingerprint, size = CHECKPOINT_HEADER.unpack(f.read(CHECKPOINT_HEADER.size))
+            if magic != CHECKPOINT_MAGIC:
+                return None
+
+            movie_ids = array('q')
+            totals = array('d')
+            counts = array('q')
 
-    raw_genres = raw_genres.strip()
-    re_result = re.search(no_genres_regexp, raw_genres)
+            for values in (movie_ids, totals, counts):
+                values.fromfile(f, size)
+    except (OSError, EOFError, struct.error):
+        return None
 
-    if re_result:
-        raise Exception("invalid genre")
+    # Checkpoint arrays are little-endian
+    if sys.byteorder == 'big':
+        for values in (movie_ids, totals, counts):
+            values.byteswap()
 
-    return raw_genres.split('|')
+    rating_storage = {movieId: {'total': total, 'count': count}
+                      for movieId, total, count in zip(movie_ids, totals, counts)}
 
+    return offset, fingerprint, rating_storage
 
-def extract_movies():
+
+def write_checkpoint(filepath, offset, fingerprint, rating_storage):
     """
-    Load all the movies and prepare dataset to filtering.
-    Return movies storage: { movieId: { title, year, [genres], rating } }
+    Write ratings checkpoint file: header of the consumed `offset` and prefix
+    `fingerprint`, then movieId, ratings total and count arrays.
+    File is replaced atomically.
     """
-    rating_storage = calc_avg_rating()
+    movie_ids = array('q', rating_storage)
+    totals = array('d', (items['total'] for items in rating_storage.values()))
+    counts = array('q', (items['count'] for items in rating_storage.values()))
+
+    if sys.byteorder == 'big':
+        for values in (movie_ids, totals, counts):
+            values.byteswap()
+
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, offset, fingerprint, len(movie_ids)))
+
+        for values in (movie_ids, totals, counts):
+            values.tofile(f)
+
+    os.replace(tmp_filepath, filepath)
+
+
+def calc_avg_rating():
+    """
+    Calculate average rating from ratings csv-file.
+    With the checkpoint only lines appended since the last run are parsed,
+    rewritten file is parsed from scratch.
+    Return average rating storage: { movieId: avg_rating }
+    """
+    filepath = config['ratings_fpath']
+    checkpoint_fpath = config['checkpoint_fpath']
+
+    with open(filepath, 'rb') as ratings_file:
+        header = ratings_file.readline()
+        columns = ratings_columns(header)
+        file_size = os.fstat(ratings_file.fileno()).st_size
+
+        # Raw ratings storage: { movieId: { total, count } }
+        rating_storage = {}
+        start = len(header)
+
+        if checkpoint_fpath:
+            checkpoint = read_checkpoint(checkpoint_fpath)
+            checkpoint_offset = None
+
+            if checkpoint is not None:
+                offset, fingerprint, storage = checkpoint
+
+                # Appended file keeps the consumed prefix as is
+                if start <= offset <= file_size and prefix_fingerprint(ratings_file, offset) == fingerprint:
+                    rating_storage, start = storage, offset
+                    checkpoint_offset = offset
+
+            # Checkpoint covers complete lines only
+            end = last_line_end(ratings_file, start, file_size)
+            parse_ratings(ratings_file, start, end, columns, rating_storage)
+
+            if end != checkpoint_offset:
+                write_checkpoint(checkpoint_fpath, end, prefix_fingerprint(ratings_file, end), rating_storage)
+
+            start = end
+
+        # Unterminated last line is counted by this run only
+        parse_ratings(ratings_file, start, file_size, columns, rating_storage)
 
+    # Calc & store average ratings
+    for movieId, items in rating_storage.items():
+        avg_rating = items['total'] / items['count']
+        rating_storage[movieId] = avg_rating
+
+    return rating_storage
+
+
+def split_title(raw_title):
+    """
+    Split `raw_title` string into the real title and year.
+    Return them as a tuple of (title, year).
+    """
+    return parsing.split_title(raw_title, config['patterns'])
+
+
+def split_genres(raw_genres):
+    """
+    Split `raw_genres` string into the genres list.
+    Return genres list.
+    """
+    return parsing.split_genres(raw_genres, config['patterns'])
+
+
+def extract_movies(rating_storage):
+    """
+    Load all the movies, join average ratings from `rating_storage`
+    and prepare dataset to filtering.
+    Return movies storage: [ { movieId, title, year, genre, rating } ]
+    """
     filepath = config['movies_fpath']
     encoding = config['src_encoding']
     delimiter = config['src_delimiter']
@@ -169,13 +382,11 @@ def extract_movies():
     return movies_storage
 
 
-def sorted_movies():
+def sorted_movies(movies_storage):
     """
-    Sort movies by genre ASC, rating DESC, year DESC, title ASC
+    Sort `movies_storage` in place by genre ASC, rating DESC, year DESC, title ASC
     Return sorted movies storage.
     """
-    movies_storage = extract_movies()
-
     # Group by genre, sort by rating DESC, year DESC, title ASC.
     # Sortings should be in reversed order.
     # Built-in sort works much faster than implemented
@@ -188,12 +399,11 @@ def sorted_movies():
     return movies_storage
 
 
-def filter_movies(filters):
+def filter_movies(filters, movies_storage):
     """
-    Filter movies by `filters` dictionary and store them into a deque.
+    Filter sorted `movies_storage` by `filters` dictionary and store them into a deque.
     Return movies storage.
     """
-    movies_storage = sorted_movies()
     result_storage = deque()
 
     # N is the movies count for each genre specified
@@ -261,6 +471,72 @@ def filter_movies(filters):
     return result_storage
 
 
+def write_movies(found_movies):
+    """
+    Output the found movies to the stdout in csv format.
+    """
+    headers = ['genre', 'title', 'year', 'rating']
+    delimiter = config['dst_delimiter']
+    writer = csv.DictWriter(sys.stdout, headers,
+                            delimiter=delimiter,
+                            lineterminator='\n')
+
+    write_schema = config['write_schema']
+    if write_schema:
+        writer.writeheader()
+
+    # Output the found data
+    for row in found_movies:
+        writer.writerow(row)
+
+    sys.stdout.flush()
+
+
+def get_movies(filters):
+    """
+    Run the pipeline phase by phase, each phase is profiled.
+    """
+    with timed('calc_avg_rating') as stats:
+        rating_storage = calc_avg_rating()
+        stats['rows'] = len(rating_storage)
+
+    with timed('extract_movies') as stats:
+        movies_storage = extract_movies(rating_storage)
+        stats['rows'] = len(movies_storage)
+
+    # Ratings are joined, release them before sorting
+    del rating_storage
+
+    with timed('sorted_movies') as stats:
+        movies_storage = sorted_movies(movies_storage)
+        stats['rows'] = len(movies_storage)
+
+    with timed('filter_movies') as stats:
+        found_movies = filter_movies(filters, movies_storage)
+        stats['rows'] = len(found_movies)
+
+    del movies_storage
+
+    with timed('write_movies') as stats:
+        write_movies(found_movies)
+        stats['rows'] = len(found_movies)
+
+
+def write_profile(filters, destination, total):
+    """
+    Write phases profile as json to `destination` file or to stderr for '-'.
+    """
+    report = {'filters': filters,
+              'total': total,
+              'phases': profile}
+
+    if destination == '-':
+        print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+        with open(destination, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
 def main():
     """
     Entry point: configure script, get CLI args and process target.
@@ -299,25 +575,33 @@ def main():
         if args['regexp'] is not None:
             filters['regexp'] = args['regexp']
 
-        found_movies = filter_movies(filters)
+        # Memory tracing slows the pipeline down, so it runs for profiling only
+        if args['profile'] is not None:
+            tracemalloc.start()
 
-    except Exception as e:
-        print(f"Exception: {e}", file=sys.stderr)
-        sys.exit(1)
+        profiler = None
+        if args['profile_dump'] is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
 
-    headers = ['genre', 'title', 'year', 'rating']
-    delimiter = config['dst_delimiter']
-    writer = csv.DictWriter(sys.stdout, headers,
-                            delimiter=delimiter,
-                            lineterminator='\n')
+        with timed('total') as total:
+            get_movies(filters)
 
-    write_schema = config['write_schema']
-    if write_schema:
-        writer.writeheader()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args['profile_dump'])
 
-    # Output the found data
-    for row in found_movies:
-        writer.writerow(row)
+        if args['profile'] is not None:
+            del profile['total']
+
+            # Each phase resets the traced peak: total peak is the highest of phases
+            total['peak_memory'] = max(stats['peak_memory'] for stats in profile.values())
+
+            write_profile(filters, args['profile'], total)
+
+    except Exception as e:
+        print(f"Exception: {e}", file=sys.stderr)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -7,13 +7,26 @@ Source filepaths specified in config file.
 import argparse
 import configparser
 import csv
+import itertools
+import json
 import sys
-from collections import deque
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import mysql.connector
+import mysql.connector.pooling
 
 config = {}
 
+# Query profile: summed phases timings in seconds and output rows per genre
+profile = {'phases': {}, 'rows': {}}
+profile_lock = threading.Lock()
+
+# Profiling flag: timings and rows are collected with `--profile` only
+profiling = False
+
 
 def configure():
     """
@@ -34,6 +47,10 @@ def configure():
         config['dst_encoding'] = parser.get('Destination', 'encoding')
         config['dst_delimiter'] = parser.get('Destination', 'delimiter')
         config['write_schema'] = int(parser.get('Destination', 'write_schema'))
+
+        config['stream'] = int(parser.get('Fetching', 'stream'))
+        config['batch_size'] = int(parser.get('Fetching', 'batch_size'))
+        config['workers'] = int(parser.get('Fetching', 'workers'))
     except Exception:
         raise Exception("corrupted config file")
 
@@ -49,35 +66,73 @@ def create_parser():
     parser.add_argument("--year_from", metavar="<year>", help="year-from  filter")
     parser.add_argument("--year_to", metavar="<year>", help="year-to  filter")
     parser.add_argument("--regexp", metavar="<regexp>", help="regexp filter for title")
+    parser.add_argument("--profile", metavar="<file>", nargs='?', const='-',
+                        help="write query profile as json to the file or to stderr")
     parser.add_argument("--help", action="store_true", help="show this help message and exit")
 
     return parser
 
 
+def connection_params():
+    """
+    Return database connection parameters from config.
+    """
+    return {'database': config['database'],
+            'host': config['host'],
+            'user': config['user'],
+            'password': config['password']}
+
+
+@contextmanager
+def timed(phase):
+    """
+    Add the time spent inside the block to the `phase` timing of the profile.
+    """
+    if not profiling:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with profile_lock:
+            profile['phases'][phase] = profile['phases'].get(phase, 0.0) + elapsed
+
+
 def filter_movies(filters):
     """
     Filter movies by `filters` dictionary.
-    Return filtered movies list.
+    Yield filtered movies by batches of (genre, title, year, rating) tuples.
     """
+    genres_list = [] if filters['genres'] is None else filters['genres'].split('|')
+
+    # Several genres are queried concurrently when workers are configured
+    if config['workers'] > 1 and len(genres_list) > 1:
+        yield from fan_out_movies(filters, genres_list)
+        return
+
     connection = None
     cursor = None
-    found_movies = deque()
 
     try:
-        connection = mysql.connector.connect(
-            database=config['database'],
-            host=config['host'],
-            user=config['user'],
-            password=config['password']
-        )
-
-        cursor = connection.cursor(dictionary=True)
-        cursor.callproc(config['proc_get_top_n_movies'], list(filters.values()))
-
-        for cur in cursor.stored_results():
-            found_movies.extend(cur.fetchall())
-
-        return found_movies
+        with timed('connect'):
+            connection = mysql.connector.connect(**connection_params())
+
+        if config['stream']:
+            # Unbuffered cursor: rows are read from the server while they are written
+            cursor = connection.cursor(buffered=False)
+            yield from stream_results(cursor, filters)
+        else:
+            cursor = connection.cursor()
+            with timed('execute'):
+                cursor.callproc(config['proc_get_top_n_movies'], list(filters.values()))
+
+            for cur in cursor.stored_results():
+                with timed('fetch'):
+                    rows = cur.fetchall()
+                yield rows
 
     except Exception:
         raise
@@ -89,29 +144,212 @@ def filter_movies(filters):
             connection.close()
 
 
+def stream_results(cursor, filters):
+    """
+    Call the procedure on unbuffered `cursor` and fetch each of its results
+    by `batch_size` rows.
+    Yield batches of rows.
+    """
+    placeholders = ', '.join(['%s'] * len(filters))
+    query = f"call {config['proc_get_top_n_movies']}({placeholders})"
+
+    # `multi` argument was removed in mysql-connector-python 9.2, requirements pin 8.0.30
+    with timed('execute'):
+        results = cursor.execute(query, list(filters.values()), multi=True)
+
+    while True:
+        # Each next result is sent once the server executes its statement
+        with timed('execute'):
+            result = next(results, None)
+
+        if result is None:
+            break
+
+        if not result.with_rows:
+            continue
+
+        with timed('fetch'):
+            rows = result.fetchmany(config['batch_size'])
+        while rows:
+            yield rows
+            with timed('fetch'):
+                rows = result.fetchmany(config['batch_size'])
+
+
+def fan_out_movies(filters, genres_list):
+    """
+    Run a separate procedure call for each genre of `genres_list` concurrently
+    over pooled connections.
+    Yield batches of rows in the genres order as soon as each genre is fetched.
+    """
+    workers = min(config['workers'], len(genres_list))
+    with timed('connect'):
+        pool = mysql.connector.pooling.MySQLConnectionPool(pool_name='get_movies',
+                                                          pool_size=workers,
+                                                          **connection_params())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_genre, pool, {**filters, 'genres': genre})
+                   for genre in genres_list]
+
+        # Output order follows the genres list, so a genre waits only for
+        # the preceding ones while the rest are still running
+        for future in futures:
+            yield from future.result()
+
+
+def fetch_genre(pool, filters):
+    """
+    Call the procedure for a single genre on a connection taken from `pool`.
+    Return list of results batches.
+    """
+    connection = pool.get_connection()
+    cursor = None
+
+    try:
+        cursor = connection.cursor()
+        with timed('execute'):
+            cursor.callproc(config['proc_get_top_n_movies'], list(filters.values()))
+
+        with timed('fetch'):
+            return [cur.fetchall() for cur in cursor.stored_results()]
+
+    finally:
+        if cursor:
+            cursor.close()
+        # Returns connection into the pool
+        connection.close()
+
+
 def print_movies(found_movies):
     """
-    Print found movies in the csv-like format to stdout.
+    Print found movies batches in the csv-like format to stdout.
     """
     headers = ['genre', 'title', 'year', 'rating']
     delimiter = config['dst_delimiter']
-    writer = csv.DictWriter(sys.stdout, headers,
-                            delimiter=delimiter,
-                            lineterminator='\n')
+    writer = csv.writer(sys.stdout,
+                        delimiter=delimiter,
+                        lineterminator='\n')
+
+    # Connection is opened on the first batch: failed connect leaves no header
+    batches = iter(found_movies)
+    first_rows = next(batches, None)
 
     write_schema = config['write_schema']
     if write_schema:
-        writer.writeheader()
+        writer.writerow(headers)
+
+    if first_rows is None:
+        return
+
+    # Output the found data as soon as each batch arrives
+    for rows in itertools.chain([first_rows], batches):
+        with timed('write'):
+            writer.writerows(rows)
+            sys.stdout.flush()
+
+        if profiling:
+            for row in rows:
+                genre = row[0]
+                profile['rows'][genre] = profile['rows'].get(genre, 0) + 1
+
+
+def procedure_statements(connection, filters):
+    """
+    Rebuild the select statements the procedure generates for `filters`.
+    Return list of (genre, query, params) items.
+    """
+    # Must stay in sync with the get_top_n_movies procedure:
+    # server/DDL/Procedures/create_procedure_get_top_n_movies.sql
+    cursor = connection.cursor()
+    cursor.execute("select coalesce(max(place), 0) from dst_top_movies")
+    top_k, = cursor.fetchone()
+    cursor.close()
+
+    limit = 2147483647 if filters['N'] is None else filters['N']
+    use_top = limit <= top_k and filters['regexp'] is None
+    use_year_buckets = filters['year_from'] is not None or filters['year_to'] is not None
+
+    if use_top:
+        table = 'dst_top_movies'
+        bucket_condition = 'bucket_year is not null' if use_year_buckets else 'bucket_year is null'
+    else:
+        table = 'dst_movies'
+        bucket_condition = 'true'
+
+    query = f"""
+        select genre, title, year, rating
+        from {table}
+        where
+            if(%s is null, true, regexp_like(title, %s, 'c')) and
+            if(%s is null, true, genre = %s) and
+            {bucket_condition} and
+            if(%s is null, true, year >= %s) and
+            if(%s is null, true, year <= %s)
+        order by binary genre asc, rating desc, year desc, binary title asc
+        limit %s
+    """
+
+    genres_list = [None] if filters['genres'] is None else filters['genres'].split('|')
+
+    statements = []
+    for genre in genres_list:
+        params = [filters['regexp'], filters['regexp'],
+                  genre, genre,
+                  filters['year_from'], filters['year_from'],
+                  filters['year_to'], filters['year_to'],
+                  limit]
+        statements.append((genre, query, params))
+
+    return statements
 
-    # Output the found data
-    for row in found_movies:
-        writer.writerow(row)
+
+def explain_movies(filters):
+    """
+    Capture server-side EXPLAIN ANALYZE of each procedure statement.
+    Return list of { genre, plan } items.
+    """
+    connection = mysql.connector.connect(**connection_params())
+    cursor = connection.cursor()
+
+    plans = []
+
+    try:
+        for genre, query, params in procedure_statements(connection, filters):
+            cursor.execute("explain analyze " + query, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            plans.append({'genre': genre, 'plan': plan})
+    finally:
+        cursor.close()
+        connection.close()
+
+    return plans
+
+
+def write_profile(filters, destination, total_time):
+    """
+    Write query profile as json to `destination` file or to stderr for '-'.
+    """
+    report = {'filters': filters,
+              'total': total_time,
+              'phases': profile['phases'],
+              'rows': profile['rows'],
+              'total_rows': sum(profile['rows'].values()),
+              'explain': explain_movies(filters)}
+
+    if destination == '-':
+        print(json.dumps(report, indent=2), file=sys.stderr)
+    else:
+        with open(destination, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
 
 
 def main():
     """
     Entry point: configure script, get CLI args and process target.
     """
+    global profiling
+
     # Set console encoding to UTF-8
     sys.stdout.reconfigure(encoding='utf-8')
 
@@ -146,14 +384,21 @@ def main():
         if args['regexp'] is not None:
             filters['regexp'] = args['regexp']
 
+        profiling = args['profile'] is not None
+
+        start = time.perf_counter()
+
         found_movies = filter_movies(filters)
 
+        print_movies(found_movies)
+
+        if args['profile'] is not None:
+            write_profile(filters, args['profile'], time.perf_counter() - start)
+
     except Exception as e:
         print(f"Exception: {e}", file=sys.stderr)
         sys.exit(1)
 
-    print_movies(found_movies)
-
 
 if __name__ == '__main__':
     main()
@@ -11,9 +11,14 @@ create procedure get_top_n_movies(
     in regex varchar(255)
 )
 begin
+	-- Statements built here must stay in sync with procedure_statements()
+	-- of the client get-movies.py, used to explain queries with `--profile`
 	set @genres_delimiter = '|';
 	set @max_int = 2147483647;
 
+	-- Precomputed top movies count for each bucket of dst_top_movies
+	select coalesce(max(place), 0) into @top_k from dst_top_movies;
+
 	if N is null then
 		set N = @max_int;
 	end if;
@@ -24,20 +29,40 @@ begin
     
     set genres = concat(genres, @genres_delimiter);
     
+    -- Small N without title filter is answered from the precomputed buckets:
+    -- genre buckets when no year bounds given, (genre, year) buckets otherwise
+    set @use_top = N <= @top_k and regex is null;
+    set @use_year_buckets = year_from is not null or year_to is not null;
+    
 	while genres != '' do
     
-		select 
-			genre, title, year, rating
-		from
-			dst_movies
-		where
-			if(regex is null, true, regexp_like(title, regex, 'c')) and
-            if(genres = @genres_delimiter, true, genre = left(genres, locate(@genres_delimiter, genres) - 1)) and
-            if(year_from is null, true, year >= year_from) and
-            if(year_to is null, true, year <= year_to)
-		order by
-			binary genre asc, rating desc, year desc, binary title asc
-		limit N;
+		if @use_top then
+			select 
+				genre, title, year, rating
+			from
+				dst_top_movies
+			where
+				if(genres = @genres_delimiter, true, genre = left(genres, locate(@genres_delimiter, genres) - 1)) and
+				if(@use_year_buckets, bucket_year is not null, bucket_year is null) and
+				if(year_from is null, true, year >= year_from) and
+				if(year_to is null, true, year <= year_to)
+			order by
+				binary genre asc, rating desc, year desc, binary title asc
+			limit N;
+		else
+			select 
+				genre, title, year, rating
+			from
+				dst_movies
+			where
+				if(regex is null, true, regexp_like(title, regex, 'c')) and
+				if(genres = @genres_delimiter, true, genre = left(genres, locate(@genres_delimiter, genres) - 1)) and
+				if(year_from is null, true, year >= year_from) and
+				if(year_to is null, true, year <= year_to)
+			order by
+				binary genre asc, rating desc, year desc, binary title asc
+			limit N;
+		end if;
 
 		set genres = replace(genres, left(genres, locate(@genres_delimiter, genres)), '');
 	end while;
@@ -0,0 +1,15 @@
+use movielens;
+
+drop table if exists dst_top_movies;
+
+create table dst_top_movies(
+    id int not null primary key auto_increment,
+    movieId int not null,
+    title varchar(255) not null,
+    year int not null,
+    genre varchar(30) not null,
+    rating float not null,
+    bucket_year int null,
+    place int not null,
+    index idx_dst_top_movies_bucket (genre, bucket_year, place)
+);
@@ -0,0 +1,53 @@
+use movielens;
+
+-- Number of top rated movies stored for each bucket.
+-- Queries with N greater than the stored count fall back to dst_movies.
+set @top_k = 100;
+
+truncate dst_top_movies;
+
+insert into dst_top_movies (movieId, title, year, genre, rating, bucket_year, place)
+with 
+cte_ranked_by_genre as ( 
+	select 
+		movieId, 
+        title, 
+        year, 
+        genre, 
+        rating, 
+        null as bucket_year, 
+        row_number() over ( 
+			partition by genre 
+            order by rating desc, year desc, binary title asc, movieId asc 
+        ) as place 
+	from 
+		dst_movies 
+), 
+cte_ranked_by_genre_year as ( 
+	select 
+		movieId, 
+        title, 
+        year, 
+        genre, 
+        rating, 
+        year as bucket_year, 
+        row_number() over ( 
+			partition by genre, year 
+            order by rating desc, binary title asc, movieId asc 
+        ) as place 
+	from 
+		dst_movies 
+) 
+select 
+	movieId, title, year, genre, rating, bucket_year, place 
+from 
+	cte_ranked_by_genre 
+where 
+	place <= @top_k 
+union all 
+select 
+	movieId, title, year, genre, rating, bucket_year, place 
+from 
+	cte_ranked_by_genre_year 
+where 
+	place <= @top_k;
@@ -7,6 +7,9 @@ import csv
 import sys
 
 import mysql.connector
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 
 config = {}
 
@@ -33,8 +36,14 @@ def configure():
 
         config['movies_tbl'] = parser.get('Destination', 'movies_tbl')
         config['ratings_tbl'] = parser.get('Destination', 'ratings_tbl')
+        config['dst_tbl'] = parser.get('Destination', 'dst_tbl')
+
+        config['title_regexp'] = parser.get('Extraction', 'title_regexp')
+        config['genres_delimiter'] = parser.get('Extraction', 'genres_delimiter')
+        config['no_genres_placeholder'] = parser.get('Extraction', 'no_genres_placeholder')
 
         config['chunk_size'] = int(parser.get('Loading', 'chunk_size'))
+        config['mode'] = parser.get('Loading', 'mode')
     except Exception:
         raise Exception("corrupted config file")
 
@@ -151,18 +160,129 @@ def land_ratings():
     connection.close()
 
 
+def read_csv(filepath, columns):
+    """
+    Read `columns` of the csv-file into an Arrow table of strings.
+    """
+    read_options = pv.ReadOptions(encoding=config['src_encoding'])
+    parse_options = pv.ParseOptions(delimiter=config['src_delimiter'])
+    convert_options = pv.ConvertOptions(include_columns=columns,
+                                        column_types={column: pa.string() for column in columns})
+
+    return pv.read_csv(filepath,
+                       read_options=read_options,
+                       parse_options=parse_options,
+                       convert_options=convert_options)
+
+
+def calc_avg_rating():
+    """
+    Calculate average rating of each movie from ratings csv-file.
+    Return Arrow table: (movieId, rating).
+    """
+    ratings = read_csv(config['ratings_fpath'], ['movieId', 'rating'])
+    ratings = ratings.set_column(1, 'rating', pc.cast(ratings['rating'], pa.float64()))
+
+    avg_ratings = ratings.group_by('movieId').aggregate([('rating', 'mean')])
+
+    return avg_ratings.select(['movieId', 'rating_mean']).rename_columns(['movieId', 'rating'])
+
+
+def extract_movies():
+    """
+    Split titles into the real title and year and explode genres lists
+    the same way as insert_into_dst_movies.sql does.
+    Return Arrow table: (movieId, title, year, genre, rating).
+    """
+    movies = read_csv(config['movies_fpath'], ['movieId', 'title', 'genres'])
+
+    titles = pc.utf8_trim(movies['title'], characters=' ')
+    genres = pc.utf8_trim(movies['genres'], characters=' ')
+
+    # Non-matching titles give nulls
+    title_year = pc.extract_regex(titles, pattern=config['title_regexp'])
+
+    movies = pa.table({
+        'movieId': movies['movieId'],
+        'title': pc.struct_field(title_year, [0]),
+        'year': pc.cast(pc.struct_field(title_year, [1]), pa.int32()),
+        'genres': genres
+    })
+
+    mask = pc.and_(pc.and_(pc.is_valid(movies['title']), pc.is_valid(movies['year'])),
+                   pc.not_equal(movies['genres'], config['no_genres_placeholder']))
+    movies = movies.filter(mask)
+
+    # Explode genres: one row per each (movie, genre) pair
+    genres_lists = pc.split_pattern(movies['genres'], pattern=config['genres_delimiter'])
+    parent_indices = pc.list_parent_indices(genres_lists)
+
+    movies = movies.drop(['genres']).take(parent_indices)
+    movies = movies.append_column('genre', pc.list_flatten(genres_lists))
+
+    movies = movies.join(calc_avg_rating(), keys='movieId', join_type='inner')
+
+    return movies.select(['movieId', 'title', 'year', 'genre', 'rating'])
+
+
+def load_dst_movies():
+    """
+    Compute destination movies on the landing host and bulk-load them
+    straight into the db destination table, skipping landing tables.
+    """
+    print("Compute movies")
+
+    movies = extract_movies()
+    movies = movies.set_column(0, 'movieId', pc.cast(movies['movieId'], pa.int32()))
+
+    connection = mysql.connector.connect(
+        database=config['database'],
+        host=config['host'],
+        user=config['user'],
+        password=config['password']
+    )
+
+    cursor = connection.cursor()
+
+    cursor.execute(f"truncate {config['dst_tbl']}")
+
+    print("Load movies")
+
+    query = (f"insert into {config['dst_tbl']} (movieId, title, year, genre, rating) "
+             "values (%s, %s, %s, %s, %s)")
+
+    inserted = 0
+
+    for batch in movies.to_batches(max_chunksize=config['chunk_size']):
+        rows = list(zip(*(column.to_pylist() for column in batch.columns)))
+
+        # Connector rewrites batched insert into a single multi-row query
+        cursor.executemany(query, rows)
+        connection.commit()
+
+        inserted += len(rows)
+        print(f"{inserted} records inserted")
+
+    cursor.close()
+    connection.close()
+
+
 def main():
     """
-    Entry point: load data into the landing.
+    Entry point: load data into the landing or straight into the destination.
     """
     try:
         configure()
 
-        # Load movies.csv
-        land_movies()
+        if config['mode'] == 'direct':
+            # Compute dst_movies locally instead of insert_into_dst_movies.sql
+            load_dst_movies()
+        else:
+            # Load movies.csv
+            land_movies()
 
-        # Load ratings.csv
-        land_ratings()
+            # Load ratings.csv
+            land_ratings()
 
     except Exception as e:
         print(f"Exception: {e}", file=sys.stderr)
@@ -8,6 +8,7 @@ import argparse
 import configparser
 import json
 import os
+import subprocess
 import sys
 
 # Global config
@@ -25,6 +26,7 @@ def configure():
 
     try:
         config['src_delimiter'] = parser.get('Source', 'delimiter')
+        config['ratings_agg'] = parser.get('Source', 'ratings_agg')
 
         config['dst_delimiter'] = parser.get('Destination', 'delimiter')
 
@@ -32,6 +34,23 @@ def configure():
         config['no_genres_regexp'] = parser.get('Extraction', 'no_genres_regexp')
 
         config['executor'] = parser.get('Engine', 'executor')
+        config['reducers'] = int(parser.get('Engine', 'reducers'))
+        config['partitions'] = parser.get('Engine', 'partitions')
+        config['sample_size'] = int(parser.get('Engine', 'sample_size'))
+        config['format'] = parser.get('Engine', 'format')
+
+        config['index'] = None
+        if int(parser.get('Index', 'enabled')):
+            config['index'] = parser.get('Index', 'dir')
+
+        if config['executor'] == 'local':
+            config['server_dir'] = parser.get('Local', 'server_dir')
+            config['input_path'] = parser.get('Local', 'input_path')
+            config['ratings_path'] = parser.get('Local', 'ratings_path')
+            config['workers'] = int(parser.get('Local', 'workers'))
+            config['split_size'] = int(parser.get('Local', 'split_size'))
+            config['spill_size'] = int(parser.get('Local', 'spill_size'))
+            config['tmp_dir'] = parser.get('Local', 'tmp_dir')
     except Exception:
         raise Exception("corrupted config file")
 
@@ -64,9 +83,15 @@ def main():
 
         mapreduce_args = {
             'src_delimiter': config['src_delimiter'],
+            'ratings_agg': config['ratings_agg'],
             'dst_delimiter': config['dst_delimiter'],
             'title_regexp': config['title_regexp'],
             'no_genres_regexp': config['no_genres_regexp'],
+            'reducers': config['reducers'],
+            'partitions': None,
+            'sample_size': config['sample_size'],
+            'format': config['format'],
+            'index': config['index'],
             'N': None,
             'genres': None,
             'year_from': None,
@@ -96,9 +121,28 @@ def main():
         if args['regexp'] is not None:
             mapreduce_args['regexp'] = args['regexp']
 
-        cmd_template = "sudo docker exec -it cloudera_quickstart {} '{}'"
-        cmd = cmd_template.format(config['executor'], json.dumps(mapreduce_args))
-        os.system(cmd)
+        # Skew-aware partition plan is used by multi-reducer jobs
+        if config['reducers'] > 1:
+            mapreduce_args['partitions'] = config['partitions']
+
+        if config['executor'] == 'local':
+            # Pure python executor running on this host
+            mapreduce_args['executor'] = {
+                'input_path': config['input_path'],
+                'ratings_path': config['ratings_path'],
+                'workers': config['workers'],
+                'split_size': config['split_size'],
+                'spill_size': config['spill_size'],
+                'tmp_dir': config['tmp_dir']
+            }
+
+            executor_path = os.path.join(config['server_dir'], 'executor.py')
+            subprocess.run([sys.executable, executor_path, json.dumps(mapreduce_args)], check=True)
+        else:
+            # No pseudo-TTY: output stays pipeable, exit status of the job is propagated
+            cmd = ['sudo', 'docker', 'exec', '-i', 'cloudera_quickstart',
+                   config['executor'], json.dumps(mapreduce_args)]
+            subprocess.run(cmd, check=True)
 
     except Exception as e:
         print(f"Exception: {e}", file=sys.stderr)
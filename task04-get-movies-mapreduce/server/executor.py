@@ -0,0 +1,354 @@
+"""
+Local multi-process MapReduce executor for get-movies mapper and reducer.
+First stage aggregates ratings into the side file for the map-side join.
+Second stage runs map tasks over input splits and reduce tasks over genre
+range partitions of the skew-aware partition plan in a process pool.
+Map output is sorted by external merge sort: map tasks spill sorted runs
+to disk, reduce tasks merge them, partial results are merged at the end.
+Runs are text lines or rawbytes records by the `format` argument.
+With the `index` argument queries scan the preprocessed index instead.
+"""
+
+import csv
+import heapq
+import json
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+# Parsing module shared by the engines, Hadoop jobs get its copy next to the mapper
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'common'))
+
+import index  # noqa: E402
+import mapper  # noqa: E402
+import partitioner  # noqa: E402
+import ratings  # noqa: E402
+import reducer  # noqa: E402
+
+# Global CLI arguments storage
+args = {}
+
+
+def get_args():
+    """
+    Get CLI arguments into a dict storage.
+    """
+    global args
+    args = json.loads(sys.argv[1])
+
+
+def init_worker(worker_args):
+    """
+    Pass CLI arguments to the worker process, its mapper and reducer.
+    """
+    global args
+    args = worker_args
+
+    mapper.args = worker_args
+    mapper.compile_filters()
+    mapper.load_partitions(worker_args['partitions'])
+
+    ratings.args = worker_args
+
+    reducer.args = worker_args
+
+
+def load_side_file():
+    """
+    Load ratings side file into the worker mapper once.
+    """
+    if not len(mapper.ratings):
+        mapper.load_ratings(args['ratings_agg'])
+
+
+def make_splits(filepath, split_size):
+    """
+    Split input file into byte ranges aligned on lines boundaries.
+    Return list of (start, end) offsets.
+    """
+    file_size = os.path.getsize(filepath)
+    offsets = [0]
+
+    with open(filepath, 'rb') as f:
+        for start in range(split_size, file_size, split_size):
+            if start <= offsets[-1]:
+                continue
+
+            # Split starts right after the line containing byte `start - 1`
+            f.seek(start - 1)
+            f.readline()
+            offsets.append(f.tell())
+
+    offsets.append(file_size)
+
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+
+def is_binary():
+    """
+    Return True for the binary intermediate records format.
+    """
+    return args.get('format') == 'binary'
+
+
+def spill(buffers, run_dir, split_index, spill_index):
+    """
+    Sort each partition buffer and write it as a run file.
+    Return { partition: run filepath }.
+    """
+    runs = {}
+
+    for part, records in buffers.items():
+        if not records:
+            continue
+
+        records.sort()
+
+        run_path = os.path.join(run_dir, f"map-{split_index:05d}-{spill_index:03d}-part-{part:05d}")
+        if is_binary():
+            with open(run_path, 'wb') as f:
+                f.writelines(mapper.frame(record) for record in records)
+        else:
+            with open(run_path, 'w', encoding='utf-8', newline='') as f:
+                f.writelines(record + '\n' for record in records)
+
+        runs[part] = run_path
+
+    return runs
+
+
+def read_split(filepath, start, end):
+    """
+    Return lines of the `filepath` split `start`:`end`.
+    """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8').splitlines()
+
+
+def ratings_task(start, end):
+    """
+    Aggregate ratings of the ratings input split.
+    Return { movieId: [total, count] }.
+    """
+    # Fresh storage of the task: pool results must not share the module dict
+    ratings.rating_storage = {}
+
+    for row in csv.reader(read_split(args['executor']['ratings_path'], start, end),
+                          delimiter=str(args['src_delimiter'])):
+        try:
+            ratings.map(row)
+        except Exception:
+            # Skip bad data and header
+            continue
+
+    return ratings.rating_storage
+
+
+def aggregate_ratings(pool, side_path):
+    """
+    Run ratings aggregation stage and write its result into the side file.
+    """
+    settings = args['executor']
+    splits = make_splits(settings['ratings_path'], settings['split_size'])
+
+    rating_storage = {}
+    for partial_storage in pool.starmap(ratings_task, splits):
+        for movie_id, value in partial_storage.items():
+            rating_storage.setdefault(movie_id, []).append(value)
+
+    with open(side_path, 'w', encoding='utf-8', newline='') as side_file:
+        for movie_id in sorted(rating_storage):
+            movie_id, (total, count) = ratings.reduce(movie_id, rating_storage[movie_id])
+            side_file.write(ratings.format_record(movie_id, total, count) + '\n')
+
+
+def map_task(split_index, start, end, run_dir):
+    """
+    Map input split `start`:`end` into sorted run files of each partition.
+    Return list of (partition, run filepath).
+    """
+    settings = args['executor']
+
+    lines = read_split(settings['input_path'], start, end)
+
+    # Partition of each reducer token of the plan
+    if is_binary():
+        partitions = {struct.pack('>B', token): part
+                      for part, token in enumerate(mapper.plan['byte_tokens'])}
+    else:
+        partitions = {token: part for part, token in enumerate(mapper.plan['tokens'])}
+
+    buffers = {part: [] for part in partitions.values()}
+    buffered = 0
+    runs = []
+
+    def emit(genre, title, year, rating):
+        nonlocal buffered
+        if is_binary():
+            record = mapper.encode_output(genre, title, year, rating)
+            buffers[partitions[record[:1]]].append(record)
+        else:
+            record = mapper.format_output(genre, title, year, rating)
+            buffers[partitions[record.split('\t', 1)[0]]].append(record)
+        buffered += 1
+
+        if buffered >= settings['spill_size']:
+            runs.extend(spill(buffers, run_dir, split_index, len(runs)).items())
+            for records in buffers.values():
+                records.clear()
+            buffered = 0
+
+    load_side_file()
+
+    # Top n storage is module-level, one per task
+    mapper.top_storage.clear()
+
+    for row in csv.reader(lines, delimiter=str(args['src_delimiter'])):
+        try:
+            for genre, (title, year, rating) in mapper.map(row):
+                if args['N'] is not None:
+                    mapper.combine(genre, title, year, rating)
+                else:
+                    emit(genre, title, year, rating)
+        except Exception:
+            # Skip bad data
+            continue
+
+    for genre, title, year, rating in mapper.top_records():
+        emit(genre, title, year, rating)
+
+    runs.extend(spill(buffers, run_dir, split_index, len(runs)).items())
+
+    return runs
+
+
+def reduce_task(part, run_paths, output_dir):
+    """
+    Merge sorted run files of the partition and reduce them into
+    a part file of partial results.
+    Return part filepath.
+    """
+    part_path = os.path.join(output_dir, f"part-{part:05d}")
+
+    if is_binary():
+        run_files = [open(run_path, 'rb') for run_path in run_paths]
+        runs = [reducer.read_frames(run_file) for run_file in run_files]
+    else:
+        run_files = [open(run_path, encoding='utf-8', newline='') for run_path in run_paths]
+        runs = run_files
+
+    try:
+        merged = heapq.merge(*runs)
+
+        # Partial records are text in both formats
+        with open(part_path, 'w', encoding='utf-8', newline='') as part_file:
+            reducer.reduce_stream(merged, part_file, 'partial', is_binary())
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+    return part_path
+
+
+def merge_parts(part_paths, output_stream):
+    """
+    Merge sorted part files and reduce them into the `output_stream`:
+    final top N stage for the genres split into sub-partitions.
+    """
+    part_files = [open(part_path, encoding='utf-8', newline='') for part_path in part_paths]
+
+    try:
+        merged = heapq.merge(*part_files)
+        reducer.reduce_stream(merged, output_stream)
+    finally:
+        for part_file in part_files:
+            part_file.close()
+
+
+def run_job(output_stream):
+    """
+    Run ratings aggregation, map and reduce stages over the process pool.
+    """
+    settings = args['executor']
+    work_dir = tempfile.mkdtemp(prefix='get-movies-', dir=settings['tmp_dir'] or None)
+
+    try:
+        run_dir = os.path.join(work_dir, 'runs')
+        output_dir = os.path.join(work_dir, 'output')
+        os.mkdir(run_dir)
+        os.mkdir(output_dir)
+
+        args['ratings_agg'] = os.path.join(work_dir, 'ratings_agg.tsv')
+
+        # Parent process samples input and runs the final merge stage
+        partitioner.args = args
+        reducer.args = args
+
+        # Partition plan is made from the input sample before workers start
+        counts = partitioner.sample_genres(settings['input_path'], args['sample_size'])
+        plan = partitioner.make_plan(counts, args['reducers'])
+
+        args['partitions'] = os.path.join(work_dir, 'partitions.json')
+        with open(args['partitions'], 'w', encoding='utf-8') as plan_file:
+            json.dump(plan, plan_file)
+
+        splits = make_splits(settings['input_path'], settings['split_size'])
+
+        with multiprocessing.Pool(settings['workers'], initializer=init_worker, initargs=(args,)) as pool:
+            # Side file is complete before map tasks lazily load it
+            aggregate_ratings(pool, args['ratings_agg'])
+
+            map_results = pool.starmap(map_task, [(i, start, end, run_dir)
+                                                  for i, (start, end) in enumerate(splits)])
+
+            # Shuffle: collect run files of each partition from all map tasks
+            partitions = {}
+            for runs in map_results:
+                for part, run_path in runs:
+                    partitions.setdefault(part, []).append(run_path)
+
+            part_paths = pool.starmap(reduce_task, [(part, run_paths, output_dir)
+                                                    for part, run_paths in sorted(partitions.items())])
+
+        merge_parts(part_paths, output_stream)
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_indexed(output_stream):
+    """
+    Build the index of the input files once and scan it.
+    """
+    settings = args['executor']
+
+    index.args = args
+    mapper.args = args
+    reducer.args = args
+    mapper.compile_filters()
+
+    index_path = index.ensure_index(settings['input_path'], settings['ratings_path'], args['index'])
+    index.query(index_path, output_stream)
+
+
+def main():
+    """
+    Entry point: get CLI args and run the job or the index query locally.
+    """
+    get_args()
+
+    # Set console encoding to UTF-8
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    if args.get('index'):
+        run_indexed(sys.stdout)
+    else:
+        run_job(sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
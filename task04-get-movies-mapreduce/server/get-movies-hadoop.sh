@@ -1,23 +1,134 @@
 #!/bin/bash
 
+# Exit status of the job is the status of the utility: failed
+# pipeline stages are not hidden by the stages after them
+set -o pipefail
+
 args=$1
 
 export DIR=/root
 
+index=$(python -c 'import json, sys; print(json.loads(sys.argv[1]).get("index") or "")' "$args")
+
+if [ -n "$index" ]; then
+     # Index mode: filter-independent index of the input is built once per
+     # input checksum and put into HDFS, queries are map-only jobs over
+     # the part files of the relevant genres
+     checksum=$(python $DIR/index.py "$args" checksum $DIR/movies.csv $DIR/ratings.csv $DIR/index) || exit 1
+
+     if ! hdfs dfs -test -e $index/$checksum/manifest.json; then
+          index_path=$(python $DIR/index.py "$args" build $DIR/movies.csv $DIR/ratings.csv $DIR/index) || exit 1
+
+          hdfs dfs -mkdir -p $index
+          hdfs dfs -rm -r -f $index/$checksum
+          hdfs dfs -put $index_path $index/$checksum
+     fi
+
+     inputs=$(hdfs dfs -cat $index/$checksum/manifest.json | python $DIR/index.py "$args" inputs $index/$checksum) || exit 1
+
+     if [ -n "$inputs" ]; then
+          # Part files are not split, so each genre is scanned by one mapper in rank order
+          yarn jar /usr/lib/hadoop-mapreduce/hadoop-streaming.jar \
+               -D mapreduce.job.reduces=0 \
+               -D mapreduce.input.fileinputformat.split.minsize=9223372036854775807 \
+               -input $inputs \
+               -output /task04/output \
+               -file $DIR/index.py $DIR/mapper.py $DIR/parsing.py $DIR/reducer.py $DIR/ratings.py \
+               -mapper "python index.py '$args' map" || exit 1
+
+          hdfs dfs -get /task04/output $DIR
+
+          hdfs dfs -rm -r /task04/output
+
+          # Mappers outputs come in arbitrary order: stable sort by genre keeps ranks
+          LC_ALL=C sort -s -t "$(printf '\t')" -k1,1 $DIR/output/part-* | cut -f 2- || exit 1
+
+          rm -r $DIR/output
+     fi
+
+     exit 0
+fi
+
 hdfs dfs -mkdir /task04
 hdfs dfs -put $DIR/movies.csv /task04
+hdfs dfs -put $DIR/ratings.csv /task04
+
+# Stage 1: aggregate ratings into the (movieId, total, count) side file
+yarn jar /usr/lib/hadoop-mapreduce/hadoop-streaming.jar \
+     -input /task04/ratings.csv \
+     -output /task04/ratings_agg \
+     -file $DIR/ratings.py \
+     -mapper "python ratings.py '$args' map" \
+     -combiner "python ratings.py '$args' reduce" \
+     -reducer "python ratings.py '$args' reduce" || exit 1
+
+rm -f $DIR/ratings_agg.tsv
+hdfs dfs -getmerge /task04/ratings_agg $DIR/ratings_agg.tsv
+
+hdfs dfs -rm -r /task04/ratings_agg
 
+reducers=$(python -c 'import json, sys; print(json.loads(sys.argv[1])["reducers"])' "$args")
+format=$(python -c 'import json, sys; print(json.loads(sys.argv[1]).get("format") or "text")' "$args")
+
+if [ "$reducers" -gt 1 ]; then
+     # Skew-aware plan: heavy genres are split into sub-partitions, genres
+     # buckets go to reducers as contiguous ranges. Mapper prefixes records
+     # with the token the partitioner routes to the planned reducer
+     python $DIR/partitioner.py "$args" $DIR/movies.csv > $DIR/partitions.json
+
+     key_fields=5
+     files="$DIR/mapper.py $DIR/parsing.py $DIR/reducer.py $DIR/ratings_agg.tsv $DIR/partitions.json"
+     reducer_mode=partial
+else
+     key_fields=4
+     files="$DIR/mapper.py $DIR/parsing.py $DIR/reducer.py $DIR/ratings_agg.tsv"
+     reducer_mode=final
+fi
+
+if [ "$format" = "binary" ]; then
+     # Rawbytes records are sorted as raw bytes and partitioned by the first
+     # byte: plan token, or genre code for the single reducer. Combiner is
+     # skipped: its output format would follow the text reducer output
+     job_options="-D stream.map.output=rawbytes \
+                  -D stream.reduce.input=rawbytes \
+                  -D mapreduce.partition.binarypartitioner.left.offset=0 \
+                  -D mapreduce.partition.binarypartitioner.right.offset=0"
+     partitioner=org.apache.hadoop.mapred.lib.BinaryPartitioner
+     combiner=""
+else
+     job_options="-D stream.num.map.output.key.fields=$key_fields \
+                  -D mapreduce.partition.keypartitioner.options=-k1,1"
+     partitioner=org.apache.hadoop.mapred.lib.KeyFieldBasedPartitioner
+     combiner="python reducer.py '$args' combine"
+fi
+
+# Stage 2: side file is shipped to each mapper for the map-side join.
+# Composite key (genre, inverted rating, inverted year, title) is partitioned
+# by genre only (or by plan token), so each reducer gets whole genres
+# (or genres sub-partitions) already ranked
 yarn jar /usr/lib/hadoop-mapreduce/hadoop-streaming.jar \
+     $job_options \
+     -D mapreduce.job.reduces=$reducers \
      -input /task04/movies.csv \
      -output /task04/output \
-     -file $DIR/mapper.py $DIR/reducer.py \
+     -file $files \
      -mapper "python mapper.py '$args'" \
-     -reducer "python reducer.py '$args'"
+     ${combiner:+-combiner "$combiner"} \
+     -reducer "python reducer.py '$args' $reducer_mode" \
+     -partitioner $partitioner || exit 1
 
 hdfs dfs -get /task04/output $DIR
 
 hdfs dfs -rm -r /task04/output
 
-cat $DIR/output/part-00000
+if [ "$reducers" -gt 1 ]; then
+     # Final top N stage: merge sorted partial results of the parts
+     LC_ALL=C sort -m $DIR/output/part-* | python $DIR/reducer.py "$args" merge
+else
+     cat $DIR/output/part-00000
+fi
+status=$?
 
 rm -r $DIR/output
+
+exit $status
@@ -1,12 +1,43 @@
 #!/bin/bash
 
+# Exit status of the job is the status of the utility: failed
+# pipeline stages are not hidden by the stages after them
+set -o pipefail
+
 args=$1
 
 export DIR=/root
 
-cat $DIR/movies.csv |
-python $DIR/mapper.py "$args" |
-sort |
-python $DIR/reducer.py "$args"
+cd $DIR
+
+# Line-oriented `sort` of the emulation supports text records only
+format=$(python -c 'import json, sys; print(json.loads(sys.argv[1]).get("format") or "text")' "$args")
+if [ "$format" != "text" ]; then
+     echo "Exception: $format format is not supported by the hadoop emulation" >&2
+     exit 1
+fi
+
+index=$(python -c 'import json, sys; print(json.loads(sys.argv[1]).get("index") or "")' "$args")
+
+if [ -n "$index" ]; then
+     # Filter-independent index is built once per input checksum, queries only scan it
+     index_path=$(python $DIR/index.py "$args" build $DIR/movies.csv $DIR/ratings.csv $index) &&
+     python $DIR/index.py "$args" query $index_path
+else
+     # Stage 1: aggregate ratings into the side file
+     cat $DIR/ratings.csv |
+     python $DIR/ratings.py "$args" map |
+     LC_ALL=C sort |
+     python $DIR/ratings.py "$args" reduce > $DIR/ratings_agg.tsv &&
+
+     # Stage 2: join ratings on the map side and rank movies
+     cat $DIR/movies.csv |
+     python $DIR/mapper.py "$args" |
+     LC_ALL=C sort |
+     python $DIR/reducer.py "$args"
+fi
+status=$?
 
 read
+
+exit $status
@@ -0,0 +1,365 @@
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import sys
+
+import mapper
+import ratings
+import reducer
+
+# Input files read chunk size for the checksum
+CHUNK_SIZE = 1 << 20
+
+# Index manifest filename: { checksum, genres: { genre: [part filename, records count] } }
+MANIFEST = 'manifest.json'
+
+# Input checksums cache filename of the index directory:
+# { "<movies>|<ratings>": { stat: [settings, files stats], checksum } }
+CHECKSUMS = 'checksums.json'
+
+# Global CLI arguments storage
+args = {}
+
+
+def get_args():
+    """
+    Get CLI arguments into a dict storage.
+    """
+    global args
+    args = json.loads(sys.argv[1])
+
+
+def open_file(filepath, mode='r'):
+    """
+    Open UTF-8 text file with native strings in both python versions.
+    Return file object.
+    """
+    if sys.version_info[0] < 3:
+        return open(filepath, mode + 'b')
+
+    return io.open(filepath, mode, encoding='utf-8', newline='')
+
+
+def checksum(movies_path, ratings_path):
+    """
+    Return sha1 hex digest of the input files and of the extraction
+    settings the index records depend on.
+    """
+    digest = hashlib.sha1()
+
+    for setting in ('src_delimiter', 'title_regexp', 'no_genres_regexp'):
+        digest.update(args[setting].encode('utf-8') + b'\n')
+
+    for filepath in (movies_path, ratings_path):
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def input_stat(movies_path, ratings_path):
+    """
+    Return the checksum validity key: extraction settings and
+    (size, mtime) of the input files.
+    """
+    stats = []
+    for filepath in (movies_path, ratings_path):
+        stat = os.stat(filepath)
+        stats.append([stat.st_size, stat.st_mtime])
+
+    return [[args[setting] for setting in ('src_delimiter', 'title_regexp', 'no_genres_regexp')], stats]
+
+
+def cached_checksum(movies_path, ratings_path, index_dir):
+    """
+    Return checksum of the input files, computed only when the files
+    size or mtime differ from the ones cached in the `index_dir`.
+    """
+    cache_path = os.path.join(index_dir, CHECKSUMS)
+    key = os.path.abspath(movies_path) + '|' + os.path.abspath(ratings_path)
+    stat = input_stat(movies_path, ratings_path)
+
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path) as cache_file:
+                cache = json.load(cache_file)
+        except ValueError:
+            # Rebuild corrupted cache
+            cache = {}
+
+    entry = cache.get(key)
+    if entry is not None and entry['stat'] == stat:
+        return entry['checksum']
+
+    digest = checksum(movies_path, ratings_path)
+    cache[key] = {'stat': stat, 'checksum': digest}
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    # Cache is replaced atomically for concurrent queries
+    tmp_path = cache_path + '.%d.tmp' % os.getpid()
+    with open(tmp_path, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.rename(tmp_path, cache_path)
+
+    return digest
+
+
+def aggregate_ratings(ratings_path, side_path):
+    """
+    Aggregate ratings csv-file into the (movieId, total, count) side file.
+    """
+    ratings.args = args
+    ratings.rating_storage.clear()
+
+    with open_file(ratings_path) as f:
+        for row in csv.reader(f, delimiter=str(args['src_delimiter'])):
+            try:
+                ratings.map(row)
+            except Exception:
+                # Skip bad data and header
+                continue
+
+    with open_file(side_path, 'w') as side_file:
+        for movie_id in sorted(ratings.rating_storage):
+            total, count = ratings.rating_storage[movie_id]
+            side_file.write(ratings.format_record(movie_id, total, count) + '\n')
+
+
+def build_index(movies_path, ratings_path, index_path):
+    """
+    Build filter-independent index of all the movies: ranked records of
+    each genre sorted into a separate part file, as the reducer gets them.
+    Index is built aside and renamed into `index_path` when complete.
+    """
+    build_path = index_path + '.tmp'
+    shutil.rmtree(build_path, ignore_errors=True)
+    os.makedirs(build_path)
+
+    side_path = os.path.join(build_path, 'ratings_agg.tsv')
+    aggregate_ratings(ratings_path, side_path)
+
+    # Mapper parses titles and joins ratings without any filters
+    mapper.args = dict(args, N=None, genres=None, year_from=None, year_to=None, regexp=None)
+    mapper.compile_filters()
+    mapper.load_ratings(side_path)
+
+    storage = {}
+
+    with open_file(movies_path) as movies_file:
+        rows = csv.reader(movies_file, delimiter=str(args['src_delimiter']))
+
+        while True:
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except csv.Error:
+                # Skip malformed line
+                continue
+
+            try:
+                for genre, (title, year, rating) in mapper.map(row):
+                    storage.setdefault(genre, []).append(mapper.format_record(genre, title, year, rating))
+            except Exception:
+                # Skip bad data and header
+                continue
+
+    os.remove(side_path)
+
+    # Restore query filters
+    mapper.args = args
+    mapper.compile_filters()
+
+    manifest = {'checksum': os.path.basename(index_path), 'genres': {}}
+
+    for i, genre in enumerate(sorted(storage)):
+        records = storage[genre]
+        records.sort()
+
+        filename = 'part-%05d' % i
+        with open_file(os.path.join(build_path, filename), 'w') as part_file:
+            part_file.writelines(record + '\n' for record in records)
+
+        manifest['genres'][genre] = [filename, len(records)]
+
+    with open(os.path.join(build_path, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    shutil.rmtree(index_path, ignore_errors=True)
+    os.rename(build_path, index_path)
+
+
+def ensure_index(movies_path, ratings_path, index_dir):
+    """
+    Build the index of the input files unless it is already built.
+    Return index path: `index_dir` subdirectory named by the input checksum.
+    """
+    index_path = os.path.join(index_dir, cached_checksum(movies_path, ratings_path, index_dir))
+
+    if not os.path.exists(os.path.join(index_path, MANIFEST)):
+        build_index(movies_path, ratings_path, index_path)
+
+    return index_path
+
+
+def load_manifest(stream):
+    """
+    Load index manifest from the `stream`.
+    """
+    return json.loads(stream.read())
+
+
+def select_parts(manifest):
+    """
+    Return part filenames of the genres relevant to the genres filter,
+    in genre order.
+    """
+    genres = sorted(manifest['genres'])
+
+    if mapper.filters['genres'] is not None:
+        genres = [genre for genre in genres if genre in mapper.filters['genres']]
+
+    return [manifest['genres'][genre][0] for genre in genres]
+
+
+def parse_record(line):
+    """
+    Split index record line into (genre, title, year, rating).
+    Title is kept as is for the regexp filter.
+    """
+    genre, inverted_rating, inverted_year, title = line.rstrip('\n').split('\t', 3)
+
+    return genre, title, mapper.MAX_YEAR - int(inverted_year), reducer.restore_rating(inverted_rating)
+
+
+def filter_records(lines):
+    """
+    Yield (genre, title, year, rating) of the sorted index `lines`
+    passing year and title filters, in rank order.
+    """
+    filters = mapper.filters
+
+    for line in lines:
+        genre, title, year, rating = parse_record(line)
+
+        # Filter `year from`
+        if filters['year_from'] is not None:
+            if year < filters['year_from']:
+                continue
+
+        # Filter `year to`
+        if filters['year_to'] is not None:
+            if year > filters['year_to']:
+                continue
+
+        # Filter `regexp` for title
+        if filters['regexp'] is not None:
+            if not filters['regexp'].search(title):
+                continue
+
+        yield genre, title.strip(), year, rating
+
+
+def create_writer(output_stream):
+    """
+    Return csv writer of the output rows, as the reducer has.
+    """
+    headers = ['genre', 'title', 'year', 'rating']
+
+    return csv.DictWriter(output_stream, headers,
+                          delimiter=str(args['dst_delimiter']),
+                          lineterminator='\n')
+
+
+def write_records(csv_writer, records):
+    """
+    Write (genre, title, year, rating) records as csv rows.
+    """
+    for genre, title, year, rating in records:
+        row = {'genre': genre, 'title': title, 'year': year, 'rating': rating}
+        csv_writer.writerow(row)
+
+
+def query(index_path, output_stream):
+    """
+    Scan part files of the relevant genres only and write top N
+    filtered records of each genre: records are already ranked,
+    so each scan stops after N matches.
+    """
+    with open(os.path.join(index_path, MANIFEST)) as manifest_file:
+        manifest = load_manifest(manifest_file)
+
+    csv_writer = create_writer(output_stream)
+
+    for filename in select_parts(manifest):
+        with open_file(os.path.join(index_path, filename)) as part_file:
+            records = filter_records(part_file)
+
+            if args['N'] is not None:
+                records = itertools.islice(records, int(args['N']))
+
+            write_records(csv_writer, records)
+
+        output_stream.flush()
+
+
+def run_map():
+    """
+    Map-only flow over the index part files of the relevant genres:
+    write top N filtered records of each genre as `genre<TAB>csv row` lines
+    for the final ordering by genre. Input is read to the end,
+    as Hadoop streaming expects.
+    """
+    counts = {}
+
+    csv_writer = create_writer(sys.stdout)
+
+    for genre, title, year, rating in filter_records(sys.stdin):
+        counts[genre] = counts.get(genre, 0) + 1
+
+        if args['N'] is None or counts[genre] <= int(args['N']):
+            sys.stdout.write(genre + '\t')
+            write_records(csv_writer, [(genre, title, year, rating)])
+
+
+def main():
+    """
+    Entry point: get CLI args and process the index command:
+    - `checksum <movies> <ratings> <index dir>` prints the input checksum cached in the index dir;
+    - `build <movies> <ratings> <index dir>` builds the index if missing and prints its path;
+    - `query <index path>` scans the local index;
+    - `inputs <index path>` prints relevant part files paths for the manifest of stdin;
+    - `map` is the mapper of the map-only Hadoop job.
+    """
+    get_args()
+
+    mapper.args = args
+    mapper.compile_filters()
+
+    reducer.args = args
+
+    command = sys.argv[2]
+
+    if command == 'checksum':
+        print(cached_checksum(sys.argv[3], sys.argv[4], sys.argv[5]))
+    elif command == 'build':
+        print(ensure_index(sys.argv[3], sys.argv[4], sys.argv[5]))
+    elif command == 'query':
+        query(sys.argv[3], sys.stdout)
+    elif command == 'inputs':
+        manifest = load_manifest(sys.stdin)
+        print(','.join(sys.argv[3] + '/' + filename for filename in select_parts(manifest)))
+    else:
+        run_map()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,58 @@
+import array
+import bisect
 import csv
+import io
 import json
+import os
 import re
+import struct
 import sys
+import zlib
+
+import parsing
+
+# Inverted year is `MAX_YEAR - year`: plain key sorting gives years DESC
+MAX_YEAR = 9999
+
+# Inverted rating is `MAX_BITS - bits` of the float: plain key sorting gives ratings DESC
+MAX_BITS = 0xFFFFFFFFFFFFFFFF
+
+# Average ratings array placeholder for movies without ratings
+NO_RATING = -1.0
+
+# Input/output streams buffer size
+BUFFER_SIZE = 1 << 20
+
+# Static MovieLens genres table in byte order: binary records store genre
+# index + 1 as a single byte code, so codes sort as the genres themselves
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime',
+          'Documentary', 'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX',
+          'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+GENRE_CODES = dict((genre, i + 1) for i, genre in enumerate(GENRES))
+
+# Escape code of genres missing in the table: code, genre, zero byte.
+# Such genres sort after all the known ones
+UNKNOWN_GENRE = 0xFF
+
+# Empty value of rawbytes map output: all the record is in the key
+EMPTY_VALUE = struct.pack('>i', 0)
 
 # Global CLI arguments storage
 args = {}
 
+# Filters precompiled from CLI arguments
+filters = {}
+
+# Average ratings indexed by movieId, loaded from the side file
+ratings = array.array('d')
+
+# In-mapper top n storage: { genre: sorted [ (-rating, -year, title) ] }
+top_storage = {}
+
+# Skew-aware partition plan made by partitioner.py:
+# { tokens, genres, reducers } and `byte_tokens` for binary format
+plan = {}
+
 
 def get_args():
     """
@@ -15,18 +62,96 @@ def get_args():
     args = json.loads(sys.argv[1])
 
 
+def compile_filters():
+    """
+    Precompile CLI arguments into `filters` once:
+    regexps, genres set and integer year bounds.
+    """
+    filters['patterns'] = parsing.compile_patterns(args['title_regexp'], args['no_genres_regexp'])
+
+    filters['genres'] = None
+    if args['genres'] is not None:
+        filters['genres'] = set(split_genres(args['genres']))
+
+    filters['year_from'] = None
+    if args['year_from'] is not None:
+        filters['year_from'] = int(args['year_from'])
+
+    filters['year_to'] = None
+    if args['year_to'] is not None:
+        filters['year_to'] = int(args['year_to'])
+
+    filters['regexp'] = None
+    if args['regexp'] is not None:
+        filters['regexp'] = re.compile(args['regexp'])
+
+
+def load_ratings(filepath):
+    """
+    Load (movieId, total, count) side file into the `ratings` array
+    of average ratings indexed by movieId for the map-side join.
+    """
+    with open(filepath) as side_file:
+        for line in side_file:
+            movie_id, total, count = line.split('\t')
+            movie_id = int(movie_id)
+
+            if movie_id >= len(ratings):
+                ratings.extend([NO_RATING] * (movie_id + 1 - len(ratings)))
+
+            ratings[movie_id] = float(total) / int(count)
+
+
+def to_native(value):
+    """
+    Return native string of the `value` json string.
+    """
+    if sys.version_info[0] < 3 and not isinstance(value, str):
+        return value.encode('utf-8')
+
+    return value
+
+
+def load_partitions(filepath):
+    """
+    Load partition plan from the file made by partitioner.py.
+    """
+    with open(filepath) as plan_file:
+        plan.update(json.load(plan_file))
+
+    # Python 2 json gives unicode: tokens and genres are joined and
+    # compared with the native strings of the records
+    plan['tokens'] = [to_native(token) for token in plan['tokens']]
+    plan['genres'] = [to_native(genre) for genre in plan['genres']]
+
+
+def partition_reducer(genre, title):
+    """
+    Return number of the reducer the record goes to by partition plan.
+    Heavy genres are spread over sub-partitions by title hash,
+    genres missing in the plan go to the reducer of the preceding genre.
+    """
+    i = bisect.bisect_left(plan['genres'], genre)
+
+    if i < len(plan['genres']) and plan['genres'][i] == genre:
+        reducers = plan['reducers'][i]
+        if not isinstance(title, bytes):
+            title = title.encode('utf-8')
+        reducer = reducers[(zlib.crc32(title) & 0xFFFFFFFF) % len(reducers)]
+    elif i > 0:
+        reducer = plan['reducers'][i - 1][-1]
+    else:
+        reducer = 0
+
+    return reducer
+
+
 def split_title(raw_title):
     """
     Split `raw_title` string into the real title and year.
     Return them as a tuple of (title, year).
     """
-    raw_title = raw_title.strip()
-    re_result = re.search(args['title_regexp'], raw_title)
-
-    re_title, re_year = re_result.groups()
-    title, year = re_title, int(re_year)
-
-    return title, year
+    return parsing.split_title(raw_title, filters['patterns'])
 
 
 def split_genres(raw_genres):
@@ -34,55 +159,172 @@ def split_genres(raw_genres):
     Split `raw_genres` string into the genres list.
     Return genres list.
     """
-    raw_genres = raw_genres.strip()
-    re_result = re.search(args['no_genres_regexp'], raw_genres)
-
-    if re_result:
-        raise Exception("invalid genre")
-
-    return raw_genres.split('|')
+    return parsing.split_genres(raw_genres, filters['patterns'])
 
 
-def map(line):
+def map(row):
     """
     Mapper function for mapreduce flow.
-    Yield `genre, (year, title)` pair.
+    Yield `genre, (title, year, rating)` pair for each genre of the csv `row`.
     """
-    csv_reader = csv.reader([line], delimiter=args['src_delimiter'].encode('utf-8'))
-    csv_values = next(csv_reader)
-    _, raw_title, raw_genres = csv_values
+    raw_movie_id, raw_title, raw_genres = row
+
+    # Join average rating, movies without ratings are skipped
+    rating = ratings[int(raw_movie_id)]
+    if rating == NO_RATING:
+        return
 
     genres_list = split_genres(raw_genres)
 
+    # Title is parsed and filtered once for all the movie genres
+    title, year = split_title(raw_title)
+
+    # Filter `year from`
+    if filters['year_from'] is not None:
+        if year < filters['year_from']:
+            return
+
+    # Filter `year to`
+    if filters['year_to'] is not None:
+        if year > filters['year_to']:
+            return
+
+    # Filter `regexp` for title
+    if filters['regexp'] is not None:
+        if not filters['regexp'].search(title):
+            return
+
     for genre in genres_list:
-        try:
-            title, year = split_title(raw_title)
+        # Filter `genres`
+        if filters['genres'] is not None:
+            if genre not in filters['genres']:
+                continue
 
-            # Filter `year from`
-            if args['year_from'] is not None:
-                if year < int(args['year_from']):
-                    continue
+        yield genre, (title, year, rating)
 
-            # Filter `year to`
-            if args['year_to'] is not None:
-                if year > int(args['year_to']):
-                    continue
 
-            # Filter `genres`
-            if args['genres'] is not None:
-                if genre not in split_genres(args['genres']):
-                    continue
+def invert_rating(rating):
+    """
+    Return fixed-width hex of the inverted `rating` float bits.
+    Bits of non-negative floats are ordered as the floats themselves.
+    """
+    bits, = struct.unpack('>Q', struct.pack('>d', rating))
 
-            # Filter `regexp` for title
-            if args['regexp'] is not None:
-                if not re.search(args['regexp'], title):
-                    continue
+    return '%016x' % (MAX_BITS - bits)
 
-            yield genre, (title, year)
 
-        except Exception:
-            # Skip bad data
-            continue
+def format_record(genre, title, year, rating):
+    """
+    Return composite key line: genre, inverted rating, inverted year, title.
+    Key fields sorting gives genre ASC, rating DESC, year DESC, title ASC.
+    """
+    return "%s\t%s\t%04d\t%s" % (genre, invert_rating(rating), MAX_YEAR - year, title)
+
+
+def format_output(genre, title, year, rating):
+    """
+    Return map output line: record prefixed with the partition token
+    when the partition plan is used.
+    """
+    record = format_record(genre, title, year, rating)
+
+    if plan:
+        return plan['tokens'][partition_reducer(genre, title)] + '\t' + record
+
+    return record
+
+
+def to_bytes(value):
+    """
+    Return UTF-8 bytes of the `value` string.
+    """
+    if isinstance(value, bytes):
+        return value
+
+    return value.encode('utf-8')
+
+
+def encode_record(genre, title, year, rating):
+    """
+    Return binary composite key: genre code, inverted rating bits,
+    inverted year, title. Fixed-width big-endian fields give the same
+    byte sorting as text keys, unknown genres go after the known ones.
+    """
+    code = GENRE_CODES.get(genre)
+    if code is None:
+        head = struct.pack('>B', UNKNOWN_GENRE) + to_bytes(genre) + b'\x00'
+    else:
+        head = struct.pack('>B', code)
+
+    bits, = struct.unpack('>Q', struct.pack('>d', rating))
+
+    return head + struct.pack('>QH', MAX_BITS - bits, MAX_YEAR - year) + to_bytes(title)
+
+
+def encode_output(genre, title, year, rating):
+    """
+    Return binary map output key: record prefixed with the partition
+    byte token when the partition plan is used.
+    """
+    key = encode_record(genre, title, year, rating)
+
+    if plan:
+        return struct.pack('>B', plan['byte_tokens'][partition_reducer(genre, title)]) + key
+
+    return key
+
+
+def frame(key):
+    """
+    Return rawbytes key/value pair of the `key`: length-prefixed key, empty value.
+    """
+    return struct.pack('>i', len(key)) + key + EMPTY_VALUE
+
+
+def combine(genre, title, year, rating):
+    """
+    Keep only top N records of each genre in the `top_storage`,
+    so map task ships at most N records per genre.
+    """
+    values = top_storage.setdefault(genre, [])
+    value = (-rating, -year, title)
+
+    if len(values) >= int(args['N']):
+        if not values or value >= values[-1]:
+            return
+        values.pop()
+
+    bisect.insort(values, value)
+
+
+def top_records():
+    """
+    Yield combined top records as (genre, title, year, rating).
+    """
+    for genre in sorted(top_storage):
+        for rating, year, title in top_storage[genre]:
+            yield genre, title, -year, -rating
+
+
+def open_streams(binary=False):
+    """
+    Reopen stdin and stdout with large buffers,
+    stdout is binary for `binary` output format.
+    Return (input, output) streams.
+    """
+    if sys.version_info[0] < 3:
+        input_stream = os.fdopen(sys.stdin.fileno(), 'rb', BUFFER_SIZE)
+        output_stream = os.fdopen(sys.stdout.fileno(), 'wb', BUFFER_SIZE)
+    else:
+        input_stream = io.open(sys.stdin.fileno(), 'r', BUFFER_SIZE,
+                               encoding='utf-8', newline='', closefd=False)
+        if binary:
+            output_stream = io.open(sys.stdout.fileno(), 'wb', BUFFER_SIZE, closefd=False)
+        else:
+            output_stream = io.open(sys.stdout.fileno(), 'w', BUFFER_SIZE,
+                                    encoding='utf-8', newline='', closefd=False)
+
+    return input_stream, output_stream
 
 
 def main():
@@ -90,16 +332,50 @@ def main():
     Entry point: get CLI args and process mapping.
     """
     get_args()
+    compile_filters()
+    load_ratings(args['ratings_agg'])
+
+    if args.get('partitions'):
+        load_partitions(args['partitions'])
+
+    binary = args.get('format') == 'binary'
+    input_stream, output_stream = open_streams(binary)
+
+    if binary:
+        def write(genre, title, year, rating):
+            output_stream.write(frame(encode_output(genre, title, year, rating)))
+    else:
+        def write(genre, title, year, rating):
+            output_stream.write(format_output(genre, title, year, rating) + '\n')
+
+    # Single csv reader for the whole input
+    rows = csv.reader(input_stream, delimiter=str(args['src_delimiter']))
 
-    for line in sys.stdin:
+    while True:
         try:
-            for key, value in map(line):
-                genre = key
-                title, year = value
-                print("%s\t%s\t%s" % (genre, title, year))
+            row = next(rows)
+        except StopIteration:
+            break
+        except csv.Error:
+            # Skip malformed line
+            continue
+
+        try:
+            for genre, (title, year, rating) in map(row):
+                if args['N'] is not None:
+                    combine(genre, title, year, rating)
+                else:
+                    write(genre, title, year, rating)
         except Exception:
+            # Skip bad data
             continue
 
+    # Flush combined top records
+    for genre, title, year, rating in top_records():
+        write(genre, title, year, rating)
+
+    output_stream.flush()
+
 
 if __name__ == '__main__':
     main()
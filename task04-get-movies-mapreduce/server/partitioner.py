@@ -0,0 +1,178 @@
+import csv
+import json
+import os
+import sys
+
+# Width of partition tokens, enough to find a token for each of 10000 reducers
+TOKEN_WIDTH = 4
+
+# Global CLI arguments storage
+args = {}
+
+
+def get_args():
+    """
+    Get CLI arguments into a dict storage.
+    """
+    global args
+    args = json.loads(sys.argv[1])
+
+
+def java_partition(token, num_reducers):
+    """
+    Return reducer number Hadoop KeyFieldBasedPartitioner gives to the
+    ASCII `token` key field: java int hash of its bytes modulo reducers.
+    """
+    current_hash = 0
+    for char in token:
+        current_hash = (31 * current_hash + ord(char)) & 0xFFFFFFFF
+
+    return (current_hash & 0x7FFFFFFF) % num_reducers
+
+
+def make_tokens(num_reducers):
+    """
+    Find a key token routed to each reducer by Hadoop partitioner.
+    Return list of tokens indexed by reducer number.
+    """
+    tokens = [None] * num_reducers
+    found = 0
+
+    for i in range(10 ** TOKEN_WIDTH):
+        token = '%0*d' % (TOKEN_WIDTH, i)
+        reducer = java_partition(token, num_reducers)
+
+        if tokens[reducer] is None:
+            tokens[reducer] = token
+            found += 1
+
+            if found == num_reducers:
+                break
+
+    return tokens
+
+
+def binary_partition(token, num_reducers):
+    """
+    Return reducer number Hadoop BinaryPartitioner gives to the key
+    starting with the `token` byte: java hash of the signed byte modulo reducers.
+    """
+    signed_token = token - 256 if token > 127 else token
+    current_hash = (31 + signed_token) & 0xFFFFFFFF
+
+    return (current_hash & 0x7FFFFFFF) % num_reducers
+
+
+def make_byte_tokens(num_reducers):
+    """
+    Find a key byte token routed to each reducer by Hadoop BinaryPartitioner
+    over the first key byte.
+    Return list of tokens indexed by reducer number.
+    """
+    tokens = [None] * num_reducers
+
+    for token in range(256):
+        reducer = binary_partition(token, num_reducers)
+        if tokens[reducer] is None:
+            tokens[reducer] = token
+
+    if None in tokens:
+        raise Exception("too many reducers for binary format")
+
+    return tokens
+
+
+def sample_genres(filepath, sample_size):
+    """
+    Estimate genres sizes by `sample_size` lines read at evenly spaced
+    offsets of the movies csv-file.
+    Return { genre: lines count }.
+    """
+    delimiter = str(args['src_delimiter'])
+    file_size = os.path.getsize(filepath)
+    step = max(file_size // sample_size, 1)
+
+    lines = []
+    with open(filepath, 'rb') as f:
+        for offset in range(0, file_size, step):
+            # Skip partial line, or header for the first offset
+            f.seek(offset)
+            f.readline()
+
+            line = f.readline()
+            if not line:
+                break
+
+            if sys.version_info[0] >= 3:
+                line = line.decode('utf-8', 'replace')
+
+            lines.append(line)
+
+    counts = {}
+    for row in csv.reader(lines, delimiter=delimiter):
+        try:
+            for genre in row[2].strip().split('|'):
+                counts[genre] = counts.get(genre, 0) + 1
+        except IndexError:
+            # Skip bad data
+            continue
+
+    return counts
+
+
+def make_plan(counts, num_reducers):
+    """
+    Split heavy genres into sub-partitions and assign genres buckets
+    to reducers as contiguous ranges in genre order, balanced by size.
+    Return partition plan: { tokens, genres, reducers }, where `reducers`
+    lists reducer number of each sub-partition of the genre.
+    Plan of binary format jobs also has `byte_tokens`.
+    """
+    total = sum(counts.values()) or 1
+    target = float(total) / num_reducers
+
+    genres = sorted(counts)
+
+    # Buckets in genre order: (genre index, size)
+    buckets = []
+    for i, genre in enumerate(genres):
+        num_subs = min(num_reducers, max(1, int(-(-counts[genre] // target))))
+        for _ in range(num_subs):
+            buckets.append((i, float(counts[genre]) / num_subs))
+
+    reducers = [[] for _ in genres]
+    reducer = 0
+    filled = 0.0
+
+    for i, size in buckets:
+        reducers[i].append(reducer)
+        filled += size
+
+        if filled >= (reducer + 1) * target and reducer < num_reducers - 1:
+            reducer += 1
+
+    plan = {'tokens': make_tokens(num_reducers),
+            'genres': genres,
+            'reducers': reducers}
+
+    if args.get('format') == 'binary':
+        plan['byte_tokens'] = make_byte_tokens(num_reducers)
+
+    return plan
+
+
+def main():
+    """
+    Entry point: get CLI args, sample input file and print partition plan.
+    """
+    get_args()
+
+    filepath = sys.argv[2]
+    counts = sample_genres(filepath, int(args['sample_size']))
+    plan = make_plan(counts, int(args['reducers']))
+
+    print(json.dumps(plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import csv
+import itertools
+import json
+import operator
+import sys
+
+# Global CLI arguments storage
+args = {}
+
+# In-mapper ratings storage: { movieId: [total, count] }
+rating_storage = {}
+
+
+def get_args():
+    """
+    Get CLI arguments into a dict storage.
+    """
+    global args
+    args = json.loads(sys.argv[1])
+
+
+def map(row):
+    """
+    Mapper function for ratings aggregation flow.
+    Add rating of the csv `row` into the `rating_storage`.
+    """
+    _, raw_movie_id, raw_rating = row[:3]
+
+    movie_id = int(raw_movie_id)
+    rating = float(raw_rating)
+
+    if movie_id in rating_storage:
+        rating_storage[movie_id][0] += rating
+        rating_storage[movie_id][1] += 1
+    else:
+        rating_storage[movie_id] = [rating, 1]
+
+
+def format_record(movie_id, total, count):
+    """
+    Return side file line: movieId, ratings total, ratings count.
+    """
+    return "%d\t%r\t%d" % (movie_id, total, count)
+
+
+def parse_record(line):
+    """
+    Split side file line into movieId and (total, count) value.
+    """
+    movie_id, total, count = line.split("\t")
+
+    return int(movie_id), (float(total), int(count))
+
+
+def reduce(key, values):
+    """
+    Reducer function for ratings aggregation flow.
+    Sum up partial totals and counts of the movie.
+    """
+    total = 0.0
+    count = 0
+
+    for value_total, value_count in values:
+        total += value_total
+        count += value_count
+
+    return key, (total, count)
+
+
+def run_map():
+    """
+    Aggregate ratings of the csv input by movies.
+    """
+    rows = csv.reader(sys.stdin, delimiter=str(args['src_delimiter']))
+
+    for row in rows:
+        try:
+            map(row)
+        except Exception:
+            # Skip bad data and header
+            continue
+
+    for movie_id, (total, count) in rating_storage.items():
+        print(format_record(movie_id, total, count))
+
+
+def run_reduce():
+    """
+    Merge partial aggregates of the input sorted by movieId.
+    Works both as combiner and reducer.
+    """
+    records = (parse_record(line) for line in sys.stdin if line.strip())
+
+    for key, group in itertools.groupby(records, key=operator.itemgetter(0)):
+        movie_id, (total, count) = reduce(key, (value for _, value in group))
+        print(format_record(movie_id, total, count))
+
+
+def main():
+    """
+    Entry point: get CLI args and process `map` or `reduce` stage.
+    """
+    get_args()
+
+    if sys.argv[2] == 'map':
+        run_map()
+    else:
+        run_reduce()
+
+
+if __name__ == '__main__':
+    main()
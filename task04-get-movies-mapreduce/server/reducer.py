@@ -1,10 +1,30 @@
 import csv
+import itertools
 import json
+import operator
+import struct
 import sys
 
+# Inverted year is `MAX_YEAR - year`: plain key sorting gives years DESC
+MAX_YEAR = 9999
+
+# Inverted rating is `MAX_BITS - bits` of the float: plain key sorting gives ratings DESC
+MAX_BITS = 0xFFFFFFFFFFFFFFFF
+
+# Static MovieLens genres table of binary records, codes are index + 1
+GENRES = ['Action', 'Adventure', 'Animation', 'Children', 'Comedy', 'Crime',
+          'Documentary', 'Drama', 'Fantasy', 'Film-Noir', 'Horror', 'IMAX',
+          'Musical', 'Mystery', 'Romance', 'Sci-Fi', 'Thriller', 'War', 'Western']
+
+# Escape code of genres missing in the table: code, genre, zero byte
+UNKNOWN_GENRE = 0xFF
+
 # Global CLI arguments storage
 args = {}
 
+# Skipped input lines counter
+bad_records = 0
+
 
 def get_args():
     """
@@ -14,72 +34,208 @@ def get_args():
     args = json.loads(sys.argv[1])
 
 
-def shuffle(num_reducers=1):
+def invert_rating(rating):
+    """
+    Return fixed-width hex of the inverted `rating` float bits.
+    """
+    bits, = struct.unpack('>Q', struct.pack('>d', rating))
+
+    return '%016x' % (MAX_BITS - bits)
+
+
+def restore_rating(inverted_rating):
+    """
+    Return rating float from the hex of its inverted bits.
+    """
+    bits = MAX_BITS - int(inverted_rating, 16)
+
+    return struct.unpack('>d', struct.pack('>Q', bits))[0]
+
+
+def parse_record(line):
+    """
+    Split composite key line into the genre and (title, year, rating) value.
+    """
+    genre, inverted_rating, inverted_year, title = line.split("\t", 3)
+
+    return genre, (title.strip(), MAX_YEAR - int(inverted_year), restore_rating(inverted_rating))
+
+
+def to_str(value):
+    """
+    Return native string of the UTF-8 `value` bytes.
+    """
+    if sys.version_info[0] < 3:
+        return value
+
+    return value.decode('utf-8')
+
+
+def decode_record(key):
+    """
+    Split binary composite key into the genre and (title, year, rating) value.
+    """
+    code, = struct.unpack_from('>B', key, 0)
+
+    if code == UNKNOWN_GENRE:
+        end = key.index(b'\x00', 1)
+        genre, pos = to_str(key[1:end]), end + 1
+    else:
+        genre, pos = GENRES[code - 1], 1
+
+    inverted_bits, inverted_year = struct.unpack_from('>QH', key, pos)
+    rating, = struct.unpack('>d', struct.pack('>Q', MAX_BITS - inverted_bits))
+
+    return genre, (to_str(key[pos + 10:]).strip(), MAX_YEAR - inverted_year, rating)
+
+
+def read_frames(stream):
+    """
+    Yield keys of rawbytes key/value pairs of the binary `stream`:
+    each of key and value is prefixed with its 4-byte length.
+    """
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+
+        key_length, = struct.unpack('>i', header)
+        key = stream.read(key_length)
+
+        value_length, = struct.unpack('>i', stream.read(4))
+        stream.read(value_length)
+
+        yield key
+
+
+def format_record(genre, title, year, rating):
     """
-    Partition data into groups by map keys.
+    Return composite key line: genre, inverted rating, inverted year, title.
     """
-    shuffled_items = []
+    return "%s\t%s\t%04d\t%s" % (genre, invert_rating(rating), MAX_YEAR - year, title)
+
 
-    prev_key = None
-    values = []
+def read_records(stream, with_token=False, binary=False):
+    """
+    Parse input lines of `stream`, or binary keys for `binary` flag,
+    into ((token, genre), value) records.
+    Partition token is split off `with_token` flag, otherwise it is None.
+    Bad lines are skipped and counted into `bad_records`.
+    """
+    global bad_records
 
-    try:
-        for line in sys.stdin:
-            key, title, year = line.split("\t")
+    for line in stream:
+        try:
+            token = None
+            if binary:
+                if with_token:
+                    token, line = line[:1], line[1:]
 
-            if key != prev_key and prev_key != None:
-                shuffled_items.append((prev_key, values))
-                values = []
-                
-            prev_key = key
-            values.append((title.strip(), year.strip()))
-    except:
-        pass
-    finally:
-        if prev_key != None:
-            shuffled_items.append((key, values))
+                genre, value = decode_record(line)
+            else:
+                if with_token:
+                    token, line = line.split("\t", 1)
 
-    result = []
-    num_items_per_reducer = len(shuffled_items) // num_reducers
-    if len(shuffled_items) / num_reducers != num_items_per_reducer:
-        num_items_per_reducer += 1
-    for i in range(num_reducers):
-        result.append(shuffled_items[num_items_per_reducer*i:num_items_per_reducer*(i+1)])
+                genre, value = parse_record(line)
 
-    return result
+            yield (token, genre), value
+        except Exception:
+            bad_records += 1
+
+
+def shuffle(stream, with_token=False, binary=False):
+    """
+    Group sorted input records of `stream` by map keys.
+    Yield (key, values) pairs one key group at a time,
+    values are read lazily from the input.
+    """
+    records = read_records(stream, with_token, binary)
+
+    for key, group in itertools.groupby(records, key=operator.itemgetter(0)):
+        yield key, (value for _, value in group)
+
+
+def report_bad_records():
+    """
+    Report skipped input lines as a Hadoop streaming counter.
+    """
+    if bad_records:
+        sys.stderr.write("reporter:counter:Reducer,Bad records,%d\n" % bad_records)
 
 
 def reduce(key, values):
     """
     Reducer function for mapreduce flow.
+    Values come already sorted by rating DESC, year DESC, title ASC,
+    so the first N of them are streamed.
     """
     if args['N'] is not None:
-        values = values[:int(args['N'])]
-
-    values.sort(key=lambda item: item[0])
-    values.sort(key=lambda item: item[1], reverse=True)
+        values = itertools.islice(values, int(args['N']))
 
     return key, values
 
 
+def reduce_stream(input_stream, output_stream, mode='final', binary=False):
+    """
+    Reduce sorted lines of `input_stream`, or binary keys for `binary` flag,
+    into `output_stream`.
+    Modes:
+    - `final` outputs csv rows;
+    - `combine` keeps text map output format, partition tokens included;
+    - `partial` outputs text records of a partition for the final merge stage.
+    """
+    if mode != 'final':
+        with_token = bool(args.get('partitions'))
+
+        for key, values in shuffle(input_stream, with_token, binary):
+            (token, genre), title_year = reduce(key, values)
+
+            for title, year, rating in title_year:
+                record = format_record(genre, title, year, rating)
+                if mode == 'combine' and token is not None:
+                    record = token + '\t' + record
+
+                output_stream.write(record + '\n')
+        return
+
+    headers = ['genre', 'title', 'year', 'rating']
+    csv_writer = csv.DictWriter(output_stream, headers,
+                                delimiter=str(args['dst_delimiter']),
+                                lineterminator='\n')
+
+    for key, values in shuffle(input_stream, binary=binary):
+        (_, genre), title_year = reduce(key, values)
+
+        for title, year, rating in title_year:
+            row = {'genre': genre, 'title': title, 'year': year, 'rating': rating}
+            csv_writer.writerow(row)
+
+        # Group is closed: output it before reading the next one
+        output_stream.flush()
+
+
 def main():
     """
     Entry point: get CLI args and process reducing.
+    Optional `combine` or `partial` argument sets the reducing mode,
+    `merge` is the final mode of the merge stage over text partial records.
     """
     get_args()
 
-    headers = ['genre', 'title', 'year']
-    csv_writer = csv.DictWriter(sys.stdout, headers,
-                                delimiter=args['dst_delimiter'].encode('utf-8'),
-                                lineterminator='\n')
+    mode = sys.argv[2] if len(sys.argv) > 2 else 'final'
+
+    if mode == 'merge':
+        reduce_stream(sys.stdin, sys.stdout)
+    elif args.get('format') == 'binary':
+        if mode == 'combine':
+            raise Exception("combine mode needs text format")
 
-    for group in shuffle():
-        for key, values in group:
-            genre, title_year = reduce(key, values)
+        input_stream = getattr(sys.stdin, 'buffer', sys.stdin)
+        reduce_stream(read_frames(input_stream), sys.stdout, mode, binary=True)
+    else:
+        reduce_stream(sys.stdin, sys.stdout, mode)
 
-            for title, year in title_year:
-                row = {'genre': genre, 'title': title, 'year': year}
-                csv_writer.writerow(row)
+    report_bad_records()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,473 @@
+"""
+Auto-selecting utility to get top n movies by each genre from csv data.
+Estimates input size and filters selectivity and runs the get-movies utility
+expected to be the cheapest: pure python, Python/MySQL or Hadoop streaming.
+Outputs to the stdout in csv-like format: (genre, title, year, rating).
+"""
+
+import argparse
+import configparser
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Parsing module shared by the engines
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+import parsing  # noqa: E402
+
+# Engines: config section of each engine
+ENGINES = {'python': 'Python', 'sql': 'SQL', 'mapreduce': 'MapReduce'}
+
+# Output columns, the header some engines write and some don't
+HEADERS = ['genre', 'title', 'year', 'rating']
+
+# Global config
+config = {}
+
+# Verbose output flag
+verbose = False
+
+
+def configure():
+    """
+    Extract script settings from config file into a global `config`.
+    """
+    parser = configparser.ConfigParser()
+    parser.read('config.ini')
+
+    global config
+
+    try:
+        config['movies_fpath'] = parser.get('Source', 'movies_path')
+        config['ratings_fpath'] = parser.get('Source', 'ratings_path')
+        config['src_encoding'] = parser.get('Source', 'encoding')
+        config['src_delimiter'] = parser.get('Source', 'delimiter')
+
+        config['dst_delimiter'] = parser.get('Destination', 'delimiter')
+        config['write_schema'] = int(parser.get('Destination', 'write_schema'))
+
+        config['title_regexp'] = parser.get('Extraction', 'title_regexp')
+        config['no_genres_regexp'] = parser.get('Extraction', 'no_genres_regexp')
+
+        config['patterns'] = parsing.compile_patterns(config['title_regexp'], config['no_genres_regexp'])
+
+        config['engines'] = parser.get('Engines', 'engines').split('|')
+        config['sample_size'] = int(parser.get('Engines', 'sample_size'))
+
+        for engine in config['engines']:
+            section = ENGINES[engine]
+            config[engine] = {'dir': parser.get(section, 'dir'),
+                              'setup': float(parser.get(section, 'setup')),
+                              'rate': float(parser.get(section, 'rate'))}
+
+        config['top_k'] = int(parser.get('SQL', 'top_k'))
+
+        config['history_fpath'] = parser.get('Model', 'history_path')
+        config['history_size'] = int(parser.get('Model', 'history_size'))
+        config['alpha'] = float(parser.get('Model', 'alpha'))
+        config['failure_cooldown'] = float(parser.get('Model', 'failure_cooldown'))
+    except Exception:
+        raise Exception("corrupted config file")
+
+
+def create_parser():
+    """
+    Return configured parser for CLI arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, add_help=False)
+
+    parser.add_argument("--N", metavar="<number>", help="top rated movies count for each genre")
+    parser.add_argument("--genres", metavar="<list>", help="genres filter, list separated by '|'")
+    parser.add_argument("--year_from", metavar="<year>", help="year-from  filter")
+    parser.add_argument("--year_to", metavar="<year>", help="year-to  filter")
+    parser.add_argument("--regexp", metavar="<regexp>", help="regexp filter for title")
+    parser.add_argument("--verbose", action="store_true", help="show chosen engine and the reason to stderr")
+    parser.add_argument("--help", action="store_true", help="show this help message and exit")
+
+    return parser
+
+
+def log(message):
+    """
+    Print `message` to stderr in verbose mode.
+    """
+    if verbose:
+        print(message, file=sys.stderr)
+
+
+def split_title(raw_title):
+    """
+    Split `raw_title` string into the real title and year.
+    Return them as a tuple of (title, year).
+    """
+    return parsing.split_title(raw_title, config['patterns'])
+
+
+def split_genres(raw_genres):
+    """
+    Split `raw_genres` string into the genres list.
+    Return genres list.
+    """
+    return parsing.split_genres(raw_genres, config['patterns'])
+
+
+def sample_lines(filepath, sample_size):
+    """
+    Read `sample_size` lines at evenly spaced offsets of the csv-file.
+    Return sampled lines.
+    """
+    file_size = os.path.getsize(filepath)
+    step = max(file_size // sample_size, 1)
+
+    lines = []
+    with open(filepath, 'rb') as f:
+        for offset in range(0, file_size, step):
+            # Skip partial line, or header for the first offset
+            f.seek(offset)
+            f.readline()
+
+            line = f.readline()
+            if not line:
+                break
+
+            lines.append(line)
+
+    return lines
+
+
+def match(filters, genre, title, year):
+    """
+    Return True if the movie genre passes `filters`.
+    """
+    # Filter `year from`
+    if filters['year_from'] is not None:
+        if year < filters['year_from']:
+            return False
+
+    # Filter `year to`
+    if filters['year_to'] is not None:
+        if year > filters['year_to']:
+            return False
+
+    # Filter `genres`
+    if filters['genres'] is not None:
+        if genre not in filters['genres']:
+            return False
+
+    # Filter `regexp` for title
+    if filters['regexp'] is not None:
+        if not re.search(filters['regexp'], title):
+            return False
+
+    return True
+
+
+def estimate_input(filters):
+    """
+    Estimate input size and filters selectivity by the movies sample.
+    Return estimates: { input_bytes, movies, rows, selected, output },
+    where `rows` are movies exploded by genres, `selected` are rows passing
+    the filters and `output` are selected rows limited by N of each genre.
+    """
+    movies_bytes = os.path.getsize(config['movies_fpath'])
+    input_bytes = movies_bytes + os.path.getsize(config['ratings_fpath'])
+
+    lines = sample_lines(config['movies_fpath'], config['sample_size'])
+    sample_bytes = sum(len(line) for line in lines)
+
+    rows = (line.decode(config['src_encoding'], 'replace') for line in lines)
+    reader = csv.reader(rows, delimiter=config['src_delimiter'])
+
+    sampled = exploded = selected = 0
+    selected_genres = set()
+
+    for row in reader:
+        try:
+            title, year = split_title(row[1])
+            genre_list = split_genres(row[2])
+        except Exception:
+            # Skip bad data
+            continue
+
+        sampled += 1
+        exploded += len(genre_list)
+
+        for genre in genre_list:
+            if match(filters, genre, title, year):
+                selected += 1
+                selected_genres.add(genre)
+
+    # Sample is scaled to the whole file by the mean line size
+    movies = movies_bytes * len(lines) / sample_bytes if sample_bytes else 0
+    scale = movies / sampled if sampled else 0
+
+    output = selected * scale
+    if filters['N'] is not None:
+        output = min(output, filters['N'] * len(selected_genres))
+
+    return {'input_bytes': input_bytes,
+            'movies': round(movies),
+            'rows': round(exploded * scale),
+            'selected': round(selected * scale),
+            'output': round(output)}
+
+
+def engine_work(engine, filters, estimates):
+    """
+    Return work units the engine cost grows with and the reason text:
+    input bytes for engines reading all the input, rows for SQL engine.
+    """
+    if engine == 'sql':
+        if filters['N'] is not None and filters['N'] <= config['top_k'] and filters['regexp'] is None:
+            return estimates['output'], f"{estimates['output']} output rows of precomputed top {config['top_k']}"
+
+        return estimates['selected'], f"{estimates['selected']} selected rows"
+
+    if engine == 'python':
+        return estimates['input_bytes'], f"{estimates['input_bytes']} input bytes read and sorted in-process"
+
+    return estimates['input_bytes'], f"{estimates['input_bytes']} input bytes read by the job"
+
+
+def load_history():
+    """
+    Load runs history of the cost model.
+    Return history: { engines: { engine: { correction, runs, failed_at } }, runs: [ run ] }
+    """
+    history = {'engines': {}, 'runs': []}
+
+    if os.path.exists(config['history_fpath']):
+        with open(config['history_fpath'], encoding='utf-8') as history_file:
+            history = json.load(history_file)
+
+    for engine in ENGINES:
+        stats = history['engines'].setdefault(engine, {'correction': 1.0, 'runs': 0})
+        stats.setdefault('failed_at', None)
+
+    return history
+
+
+def save_history(history):
+    """
+    Save runs history of the cost model, keeping last runs only.
+    """
+    history['runs'] = history['runs'][-config['history_size']:]
+
+    with open(config['history_fpath'], 'w', encoding='utf-8') as history_file:
+        json.dump(history, history_file, indent=2)
+
+
+def prior_cost(engine, work):
+    """
+    Return configured prior cost in seconds: setup time plus work rate.
+    """
+    settings = config[engine]
+
+    return settings['setup'] + settings['rate'] * work
+
+
+def cooling_down(history, engine):
+    """
+    Return True if the engine failed within the failure cooldown.
+    """
+    failed_at = history['engines'][engine]['failed_at']
+
+    return failed_at is not None and time.time() - failed_at < config['failure_cooldown']
+
+
+def plan_engines(filters, estimates, history):
+    """
+    Predict cost of each enabled engine: prior cost scaled by the
+    correction learned from actual runtimes.
+    Return plans sorted by cost, engines cooling down after a failure
+    go last: [ (cost, engine, work, reason) ]
+    """
+    plans = []
+
+    for engine in config['engines']:
+        work, reason = engine_work(engine, filters, estimates)
+        correction = history['engines'][engine]['correction']
+        cost = prior_cost(engine, work) * correction
+
+        plans.append((cost, engine, work, reason))
+
+    plans.sort(key=lambda plan: (cooling_down(history, plan[1]), plan[0]))
+
+    return plans
+
+
+def record_run(history, engine, work, seconds):
+    """
+    Update engine correction by the actual runtime as exponential
+    moving average of actual to prior cost ratio, store the run.
+    """
+    stats = history['engines'][engine]
+    ratio = seconds / max(prior_cost(engine, work), 1e-9)
+
+    if stats['runs']:
+        alpha = config['alpha']
+        stats['correction'] = (1 - alpha) * stats['correction'] + alpha * ratio
+    else:
+        stats['correction'] = ratio
+
+    stats['runs'] += 1
+    stats['failed_at'] = None
+
+    history['runs'].append({'engine': engine,
+                            'work': work,
+                            'seconds': seconds,
+                            'failed': False,
+                            'time': time.strftime('%Y-%m-%d %H:%M:%S')})
+
+
+def record_failure(history, engine, work, seconds):
+    """
+    Mark the engine failed, so it is planned after the others until
+    the failure cooldown expires, store the run.
+    Learned correction is kept: a failure says nothing about the runtime.
+    """
+    history['engines'][engine]['failed_at'] = time.time()
+
+    history['runs'].append({'engine': engine,
+                            'work': work,
+                            'seconds': seconds,
+                            'failed': True,
+                            'time': time.strftime('%Y-%m-%d %H:%M:%S')})
+
+
+def engine_args(args):
+    """
+    Return CLI arguments passed through to the engine utility.
+    """
+    argv = []
+
+    for name in ('N', 'genres', 'year_from', 'year_to', 'regexp'):
+        if args[name] is not None:
+            argv += [f"--{name}", args[name]]
+
+    return argv
+
+
+def run_engine(engine, argv):
+    """
+    Run get-movies utility of the engine in its directory.
+    Output is captured: a failed engine leaves no partial output.
+    Return tuple of (succeeded, output, runtime in seconds).
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, 'get-movies.py'] + argv, cwd=config[engine]['dir'],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    seconds = time.perf_counter() - start
+
+    if result.returncode != 0:
+        log(f"Failure of {engine}: exit code {result.returncode} in {seconds:.3f}s")
+
+    return result.returncode == 0, result.stdout, seconds
+
+
+def write_output(output):
+    """
+    Write engine `output` to the stdout, the header is written by the
+    `write_schema` setting whether the engine writes it or not.
+    """
+    header = config['dst_delimiter'].join(HEADERS).encode('utf-8')
+
+    lines = output.splitlines(True)
+    if lines and lines[0].rstrip(b'\r\n') == header:
+        lines = lines[1:]
+
+    sys.stdout.flush()
+
+    if config['write_schema']:
+        sys.stdout.buffer.write(header + b'\n')
+
+    sys.stdout.buffer.writelines(lines)
+    sys.stdout.flush()
+
+
+def main():
+    """
+    Entry point: configure script, get CLI args, run engines from the cheapest
+    one until an engine succeeds.
+    """
+    global verbose
+
+    # Set console encoding to UTF-8
+    sys.stdout.reconfigure(encoding='utf-8')
+
+    filters = {'N': None,
+               'genres': None,
+               'year_from': None,
+               'year_to': None,
+               'regexp': None}
+
+    try:
+        configure()
+
+        parser = create_parser()
+        args = vars(parser.parse_args())
+
+        if args['help']:
+            print(parser.format_help(), file=sys.stdout)
+            sys.exit(0)
+
+        verbose = args['verbose']
+
+        if args['N'] is not None:
+            filters['N'] = int(args['N'])
+
+        if args['genres'] is not None:
+            filters['genres'] = split_genres(args['genres'])
+
+        if args['year_from'] is not None:
+            filters['year_from'] = int(args['year_from'])
+
+        if args['year_to'] is not None:
+            filters['year_to'] = int(args['year_to'])
+
+        if args['regexp'] is not None:
+            filters['regexp'] = args['regexp']
+
+        estimates = estimate_input(filters)
+        log(f"Estimates: {json.dumps(estimates)}")
+
+        history = load_history()
+        plans = plan_engines(filters, estimates, history)
+
+        for cost, engine, work, reason in plans:
+            correction = history['engines'][engine]['correction']
+            cooling = ", cooling down after failure" if cooling_down(history, engine) else ""
+            log(f"Cost of {engine}: {cost:.3f}s for {reason} (correction {correction:.3f}{cooling})")
+
+        # Failed engine falls back to the next planned one
+        for cost, engine, work, reason in plans:
+            log(f"Engine: {engine}, planned next with predicted {cost:.3f}s for {reason}")
+
+            succeeded, output, seconds = run_engine(engine, engine_args(args))
+
+            if succeeded:
+                write_output(output)
+
+                log(f"Runtime of {engine}: {seconds:.3f}s")
+                record_run(history, engine, work, seconds)
+                break
+
+            record_failure(history, engine, work, seconds)
+        else:
+            save_history(history)
+            raise Exception("all engines failed")
+
+        save_history(history)
+
+    except Exception as e:
+        print(f"Exception: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()